@@ -0,0 +1,83 @@
+'''
+bench_json_backends.py - rows/second of each installed json backend on lines shaped
+like the Amazon review and metadata files, both fully decoded and projected down to
+the fields data_parser.py reads
+
+Run from the repository base directory:
+    python benchmarks/bench_json_backends.py [number of lines]
+'''
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "final_code"))
+from json_backends import available_backends, get_decoder, make_projector #noqa: E402
+from data_parser import REVIEW_FIELDS, METADATA_FIELDS #noqa: E402
+
+WORDS = ["good", "great", "quality", "price", "fit", "love", "size", "comfortable", "the", "and",
+         "it", "not", "would", "recommend", "product", "works", "small", "return", "color", "nice"]
+
+def make_review_lines(n, seed=0):
+    '''
+    Makes n json lines with the same keys and rough sizes as the *_5.json review files
+    '''
+    rng = random.Random(seed)
+    lines = []
+    for i in range(n):
+        review = {"overall": float(rng.choice([1, 2, 3, 4, 5, 5, 5])),
+                  "vote": str(rng.randint(2, 40)),
+                  "verified": rng.random() < 0.8,
+                  "reviewTime": "01 1, 2018",
+                  "reviewerID": "A%013d" % rng.randint(0, 10**12),
+                  "asin": "B%09d" % rng.randint(0, 10**6),
+                  "style": {"Size:": " Large", "Color:": " Black"},
+                  "reviewerName": "Reviewer",
+                  "reviewText": " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 120))),
+                  "summary": " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 6))),
+                  "unixReviewTime": 1514764800}
+        if i % 10 == 0:
+            review["image"] = ["https://images-na.ssl-images-amazon.com/images/I/%d.jpg" % i]
+        lines.append(json.dumps(review))
+    return lines
+
+def make_metadata_lines(n, seed=0):
+    '''
+    Makes n json lines shaped like the meta_*.json files (long descriptions, few used fields)
+    '''
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(n):
+        meta = {"category": ["Clothing, Shoes & Jewelry", "Women"],
+                "description": [" ".join(rng.choice(WORDS) for _ in range(300))],
+                "title": " ".join(rng.choice(WORDS) for _ in range(12)),
+                "also_buy": ["B%09d" % rng.randint(0, 10**6) for _ in range(20)],
+                "brand": "Brand",
+                "feature": [" ".join(rng.choice(WORDS) for _ in range(15)) for _ in range(5)],
+                "rank": "1,234 in Clothing",
+                "main_cat": "All Beauty",
+                "asin": "B%09d" % rng.randint(0, 10**6),
+                "price": "$%.2f" % rng.uniform(1, 200)}
+        lines.append(json.dumps(meta))
+    return lines
+
+def rows_per_second(function, lines):
+    start = time.perf_counter()
+    for line in lines:
+        function(line)
+    return len(lines) / (time.perf_counter() - start)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    shapes = {"reviews": (make_review_lines(n), REVIEW_FIELDS),
+              "metadata": (make_metadata_lines(n), METADATA_FIELDS)}
+    print(f"{'shape':<10} {'backend':<10} {'full decode':>14} {'projection':>14}   (rows/second)")
+    for shape, (lines, fields) in shapes.items():
+        for backend in available_backends():
+            full = rows_per_second(get_decoder(backend), lines)
+            projected = rows_per_second(make_projector(fields, backend), lines)
+            print(f"{shape:<10} {backend:<10} {full:>14,.0f} {projected:>14,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+'''
+bench_tokenizer.py - compares the shared tokenizer (final_code/tokenizer.py) with the
+three tokenizers it replaced in main.py: word_freq's per word symbol replacing,
+preprocess_text's per character filtering and count_word_occurrences' plain split. The
+new preprocess_text and count_word_occurrences are the ones in main.py
+
+Run from the repository base directory:
+    python benchmarks/bench_tokenizer.py [number of reviews]
+'''
+import os
+import random
+import string
+import sys
+import time
+from collections import Counter
+
+# charts are saved, never shown
+os.environ.setdefault("MPLBACKEND", "Agg")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "final_code"))
+from tokenizer import count_words, get_stopwords #noqa: E402
+import main as analysis #noqa: E402
+
+WORDS = ["good", "great", "quality", "price", "fit", "love", "size", "comfortable", "the", "and",
+         "it", "not", "would", "recommend", "product", "works", "small", "return", "color", "nice",
+         "I", "This", "Great!", "don't", "it's", "well-made", "5/5", "(very)", "good.", "bad,"]
+
+def make_reviews(n, seed=0):
+    '''
+    Makes n review texts with a mix of case and punctuation
+    '''
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 80))) for _ in range(n)]
+
+def old_word_freq(texts):
+    symbols = "!@#$%^&*()_+-=[]\\{}|,./<>?:\";\'"
+    stopwords = set(get_stopwords())
+    outputDict = {}
+    for text in texts:
+        for word in text.split():
+            word = word.lower()
+            for char in symbols:
+                word = word.replace(char, "")
+            if word in stopwords or word == '':
+                continue
+            try:
+                outputDict[word] += 1
+            except KeyError:
+                outputDict[word] = 1
+    return outputDict
+
+def old_preprocess_text(texts):
+    text = " ".join(texts).lower()
+    punc = set(string.punctuation)
+    text = "".join([char for char in text if char not in punc])
+    stop_words = set(get_stopwords())
+    return Counter(word for word in text.split() if word not in stop_words)
+
+def new_preprocess_text(texts):
+    return Counter(analysis.preprocess_text(" ".join(texts)).split())
+
+def old_count_word_occurrences(texts):
+    words = " ".join(texts).lower().split()
+    word_counts = {"good": 0, "not good": 0, "total_words": len(words)}
+    for i in range(len(words)):
+        if words[i] == "not" and i + 1 < len(words) and words[i + 1] == "good":
+            word_counts["not good"] += 1
+        elif words[i] == "good":
+            word_counts["good"] += 1
+    return word_counts
+
+def new_count_word_occurrences(texts):
+    return analysis.count_word_occurrences(texts, "good")
+
+def seconds(function, texts):
+    start = time.perf_counter()
+    function(texts)
+    return time.perf_counter() - start
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    texts = make_reviews(n)
+    get_stopwords()
+    print(f"{n:,} reviews")
+    print(f"{'tokenizer':<24} {'old (s)':>9} {'new (s)':>9} {'speedup':>8}")
+    pairs = [("word_freq", old_word_freq, count_words),
+             ("preprocess_text", old_preprocess_text, new_preprocess_text),
+             ("count_word_occurrences", old_count_word_occurrences, new_count_word_occurrences)]
+    for name, old, new in pairs:
+        old_time = seconds(old, texts)
+        new_time = seconds(new, texts)
+        print(f"{name:<24} {old_time:>9.2f} {new_time:>9.2f} {old_time / new_time:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+'''
+run_benchmarks.py - times the parser and analysis functions at several input sizes
+
+For every size a review file and a matching metadata file are generated (see
+final_code/synthetic_data.py), parsed with
+process_reviews_folder and the parsed csv is then used by the analyses. Each function is
+run once to time it (throughput in reviews/second) and, unless --no-memory is given, once
+more under tracemalloc for its peak memory (tracing slows python code down, so the two are
+measured separately). The results are written as json so runs of different commits can
+be compared:
+
+Run from the repository base directory:
+    python benchmarks/run_benchmarks.py --sizes 10000 100000 1000000 -o before.json
+    python benchmarks/run_benchmarks.py --sizes 10000 100000 1000000 -o after.json --compare before.json
+'''
+import argparse
+import contextlib
+import csv
+import datetime
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+# charts are saved, never shown
+os.environ.setdefault("MPLBACKEND", "Agg")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "final_code"))
+from data_parser import parse_json_file, process_reviews_folder #noqa: E402
+from synthetic_data import generate_dataset #noqa: E402
+import main #noqa: E402
+
+# the generated reviews all go into this category
+CATEGORY = "Office_Products"
+# a slowdown above this ratio is reported by --compare, for runs of at least
+# REGRESSION_SECONDS (shorter ones are too noisy)
+REGRESSION_RATIO = 1.2
+REGRESSION_SECONDS = 0.05
+
+class Dataset:
+    '''
+    The generated files of one size, and the columns some of the functions take as lists
+    '''
+    def __init__(self, folder, n):
+        self.n = n
+        # a single category, so parse_json_file reads all of the reviews
+        self.review_dir, self.meta_dir = generate_dataset(folder, n, [CATEGORY])
+        self.review_file = os.path.join(self.review_dir, CATEGORY + "_5.json")
+        self.csv_path = os.path.join(folder, "filtered_reviews.csv")
+        self.plots_dir = os.path.join(folder, "plots")
+        self._columns = None
+
+    def column(self, name):
+        if self._columns is None:
+            with open(self.csv_path, "r", encoding="UTF8", newline="") as f:
+                reader = csv.DictReader(f)
+                rows = list(reader)
+            self._columns = {key: [row[key] for row in rows] for key in ("Review Text", "Product Price")}
+        return self._columns[name]
+
+def _ingest(data):
+    # a cold ingest: without the manifest every file is parsed again instead of reusing the
+    # earlier rows, and without the price indexes the metadata files are parsed again too
+    os.remove(data.csv_path + ".manifest.json")
+    shutil.rmtree(data.csv_path + ".price_index")
+    process_reviews_folder(data.review_dir, data.meta_dir, output_path=data.csv_path)
+
+def _zeyu_pandas(data):
+    # the DataFrame work of zeyu_linxiao_main without drawing the charts
+    frame = main.load_reviews(data.csv_path)
+    main.add_price_columns(frame)
+    frame.groupby(['Source Category', 'Price Category'], observed=True)['Rating'].mean()
+    frame['Rating'].value_counts()
+    frame.groupby('Rating')['Price Lower Bound'].agg(['mean', 'median'])
+
+# name -> (function of a Dataset, setup run before it, outside of the measurement)
+BENCHMARKS = {
+    "parse_json_file": (lambda data: sum(1 for _ in parse_json_file(data.review_file, CATEGORY + "_5.json")), None),
+    "process_reviews_folder": (_ingest, None),
+    "verified_review_ratings": (lambda data: main.verified_review_ratings(data.csv_path), None),
+    "word_freq": (lambda data: main.word_freq(data.csv_path), None),
+    "handle_price": (lambda data: [main.handle_price(price) for price in data.column("Product Price")],
+                     lambda data: data.column("Product Price")),
+    "parse_prices": (lambda data: main.parse_prices(main.pd.Series(data.column("Product Price"))),
+                     lambda data: data.column("Product Price")),
+    "preprocess_text": (lambda data: [main.preprocess_text(text) for text in data.column("Review Text")],
+                        lambda data: data.column("Review Text")),
+    "count_word_occurrences": (lambda data: main.count_word_occurrences(data.column("Review Text"), "good"),
+                               lambda data: data.column("Review Text")),
+    "zeyu_linxiao_main pandas": (_zeyu_pandas, None),
+    "zeyu_linxiao_main chunked": (lambda data: main.chunked_price_aggregates(data.csv_path, 100000), None),
+    "zeyu_linxiao_main": (lambda data: main.zeyu_linxiao_main(filename=data.csv_path, plots_dir=data.plots_dir),
+                          None),
+}
+
+def measure(function, data, memory=True):
+    '''
+    returns - (seconds, peak traced memory in MB or None)
+    '''
+    # the progress messages and deprecation warnings of the functions would break up the table
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        gc.collect()
+        start = time.perf_counter()
+        function(data)
+        seconds = time.perf_counter() - start
+        if not memory:
+            return seconds, None
+        gc.collect()
+        tracemalloc.start()
+        try:
+            function(data)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak / 2**20
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(sizes, names, memory=True):
+    '''
+    returns - list of result dicts, one per benchmark and size
+    '''
+    results = []
+    main.SAVE_PLOTS = True
+    for n in sizes:
+        folder = tempfile.mkdtemp(prefix=f"bench_{n}_")
+        try:
+            print(f"Generating {n:,} reviews")
+            with contextlib.redirect_stdout(io.StringIO()):
+                data = Dataset(folder, n)
+                # everything after the parser reads its output
+                process_reviews_folder(data.review_dir, data.meta_dir, output_path=data.csv_path)
+            for name in names:
+                function, setup = BENCHMARKS[name]
+                if setup is not None:
+                    setup(data)
+                seconds, peak = measure(function, data, memory)
+                results.append({"benchmark": name, "size": n, "seconds": seconds,
+                                "reviews_per_second": n / seconds, "peak_mb": peak})
+                peak_text = "" if peak is None else f" {peak:>10.1f}"
+                print(f"{name:<28} {n:>10,} {seconds:>10.3f} {n / seconds:>14,.0f}{peak_text}")
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+def compare(results, previous):
+    '''
+    Prints the change in time of every benchmark that is in both runs
+    '''
+    before = {(entry["benchmark"], entry["size"]): entry["seconds"] for entry in previous["results"]}
+    print(f"\nCompared with {previous.get('commit')} ({previous.get('date')}):")
+    for entry in results:
+        old = before.get((entry["benchmark"], entry["size"]))
+        if old is None:
+            continue
+        ratio = entry["seconds"] / old
+        flag = "  SLOWER" if ratio > REGRESSION_RATIO and entry["seconds"] >= REGRESSION_SECONDS else ""
+        print(f"{entry['benchmark']:<28} {entry['size']:>10,} {ratio:>8.2f}x time{flag}")
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="time the parser and analysis functions")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="json file to write the results to")
+    parser.add_argument("--compare", default=None, help="json file of an earlier run to compare with")
+    parser.add_argument("--no-memory", action="store_true", help="only measure the time")
+    args = parser.parse_args(argv)
+
+    print(f"{'benchmark':<28} {'reviews':>10} {'seconds':>10} {'reviews/second':>14}"
+          + ("" if args.no_memory else f" {'peak MB':>10}"))
+    results = run(args.sizes, args.benchmarks, not args.no_memory)
+    report = {"commit": git_commit(), "date": datetime.datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(), "platform": platform.platform(), "results": results}
+    with open(args.output, "w", encoding="UTF8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="UTF8") as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main_cli()
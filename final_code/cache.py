@@ -0,0 +1,147 @@
+'''
+cache.py - on disk cache for the results of the analyses
+
+A result is stored under a key made from the sha256 of the input file's contents, the
+analysis (aggregator class) and its parameters, so it is picked up again whenever the
+same analysis is run on the same data and can never be returned for changed data.
+Hashing a large file takes a while, so the hash of each input is remembered together
+with its size and modification time and only recomputed when those change.
+
+The cache is bounded: when the result files add up to more than max_bytes, the least
+recently used ones are removed.
+'''
+import os
+import json
+import pickle
+import hashlib
+from data_parser import file_digest
+
+# bump this when an aggregator changes what it computes, so old results are not reused
+CACHE_VERSION = 2
+
+FINGERPRINTS_FILE = "fingerprints.json"
+RESULT_SUFFIX = ".pickle"
+
+class AnalysisCache:
+    '''
+    params:
+    cache_dir - folder to keep the results in, created if needed
+    max_bytes - total size of the result files to keep
+    '''
+    def __init__(self, cache_dir=".analysis_cache", max_bytes=256 << 20):
+        assert(isinstance(cache_dir, str))
+        assert(isinstance(max_bytes, int) and max_bytes > 0)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.fingerprints_path = os.path.join(cache_dir, FINGERPRINTS_FILE)
+        try:
+            with open(self.fingerprints_path, 'r', encoding='UTF8') as f:
+                self.fingerprints = json.load(f)
+        except (OSError, ValueError):
+            self.fingerprints = {}
+
+    def fingerprint(self, filepath):
+        '''
+        sha256 of the file's contents, only recomputed when its size or modification time changed
+        params:
+        filepath - the input file
+        returns - hex digest string
+        '''
+        assert(isinstance(filepath, str))
+        stat = os.stat(filepath)
+        path = os.path.abspath(filepath)
+        known = self.fingerprints.get(path)
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        digest = file_digest(filepath)
+        self.fingerprints[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        tmp_path = self.fingerprints_path + ".tmp"
+        with open(tmp_path, 'w', encoding='UTF8') as f:
+            json.dump(self.fingerprints, f)
+        os.replace(tmp_path, self.fingerprints_path)
+        return digest
+
+    def key(self, filepath, analysis, params=None):
+        '''
+        params:
+        filepath - the input file
+        analysis - name of the analysis
+        params - json-able parameters of the analysis
+        returns - the cache key of the result
+        '''
+        description = json.dumps([CACHE_VERSION, self.fingerprint(filepath), analysis, params], sort_keys=True)
+        return hashlib.sha256(description.encode('UTF8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + RESULT_SUFFIX)
+
+    def get(self, key):
+        '''
+        returns - the stored result, or None if there is none
+        '''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        # the modification time is the last use, for evict()
+        os.utime(path)
+        return result
+
+    def put(self, key, result):
+        '''
+        Stores a result and evicts old results if the cache got too big
+        '''
+        path = self._path(key)
+        with open(path + ".tmp", 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes the least recently used results until they fit in max_bytes
+        '''
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(RESULT_SUFFIX):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+def cached_scan(filename, aggregators, cache=None, jobs=1):
+    '''
+    Same as scan_engine.scan, but takes the results that are already in the cache from
+    there and only scans the data for the rest (which are then stored)
+    params:
+    filename - the parsed csv file or the .parquet file from data_parser
+    aggregators - dict of name -> Aggregator
+    cache - AnalysisCache, or None to always scan
+    jobs - number of worker processes for scan
+    returns - dict of name -> the aggregator's result
+    '''
+    from scan_engine import scan
+    if cache is None:
+        return scan(filename, aggregators, jobs=jobs)
+    keys = {name: cache.key(filename, type(aggregator).__name__, aggregator.params())
+            for name, aggregator in aggregators.items()}
+    results = {}
+    missing = {}
+    for name, aggregator in aggregators.items():
+        result = cache.get(keys[name])
+        if result is None:
+            missing[name] = aggregator
+        else:
+            results[name] = result
+    if missing:
+        for name, result in scan(filename, missing, jobs=jobs).items():
+            cache.put(keys[name], result)
+            results[name] = result
+    return {name: results[name] for name in aggregators}
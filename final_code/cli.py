@@ -0,0 +1,257 @@
+'''
+cli.py - command line entry point for the whole pipeline
+
+    python final_code/cli.py ingest ./reviews ./metadata -o out/ --jobs 4
+    python final_code/cli.py aggregate out/filtered_reviews.csv -o out/ --jobs 4
+    python final_code/cli.py plot out/filtered_reviews.csv -o out/plots/
+
+ingest parses the raw review and metadata files (data_parser.py), aggregate runs the
+analyses of scan_engine.py and writes their results as json, and plot makes the charts
+of main.py (saved as png files by render.py). Only plot imports main.py (and with it pandas, matplotlib, seaborn, nltk and
+wordcloud), so ingest and aggregate start up quickly.
+'''
+import argparse
+import csv
+import json
+import os
+import sys
+
+ANALYSES = ["verified", "words", "category-words", "word-usage", "prices"]
+CHARTS = ["all", "connor", "zeyu", "sahil"]
+# price percentiles written by aggregate --analyses prices
+PERCENTILES = [0.1, 0.25, 0.75, 0.9]
+
+def _nest(pairs):
+    '''
+    Turns a dict keyed by (category, x) tuples into {category: {x: value}} so it can be
+    written as json
+    '''
+    nested = {}
+    for (category, key), value in pairs.items():
+        nested.setdefault(category, {})[key] = value
+    return nested
+
+def _to_json(name, result):
+    '''
+    Converts the result of one of the ANALYSES to json types
+    params:
+    name - the analysis name
+    result - what its aggregator returned
+    returns - the json-able result
+    '''
+    if name == "category-words":
+        return _nest({key: dict(counts.most_common(100)) for key, counts in result.items()})
+    if name == "word-usage":
+        return {word: _nest(cells) for word, cells in result.items()}
+    if name == "prices":
+        return {"average rating by price category": _nest({key: total / count for key, (total, count)
+                                                           in result["rating by price category"].items()}),
+                "rating counts": result["rating counts"],
+                "prices by rating": _nest({key: {"count": sketch.count, "mean": sketch.mean(),
+                                                 "median": sketch.median(),
+                                                 "percentiles": dict(zip(PERCENTILES, sketch.quantiles(PERCENTILES)))}
+                                           for key, sketch in result["prices by rating"].items()})}
+    return result
+
+def _make_aggregator(name, words, capacity=None):
+    '''
+    Imports scan_engine only when it is needed
+    '''
+    import scan_engine
+    if name == "verified":
+        return scan_engine.VerifiedRatingAggregator()
+    if name == "words":
+        return scan_engine.WordFrequencyAggregator(100, capacity)
+    if name == "category-words":
+        return scan_engine.CategoryWordAggregator()
+    if name == "word-usage":
+        return scan_engine.WordUsageAggregator(words)
+    return scan_engine.PriceStatsAggregator()
+
+def _open_cache(args):
+    '''
+    returns - the AnalysisCache asked for with --cache-dir, or None
+    '''
+    if args.cache_dir is None:
+        return None
+    from cache import AnalysisCache
+    return AnalysisCache(args.cache_dir, args.cache_mb << 20)
+
+def ingest(args):
+    '''
+    Parses the review folder into <output>/filtered_reviews.csv (and the Parquet file)
+    '''
+    from data_parser import process_reviews_folder
+    for name, folder in (("review", args.input), ("metadata", args.metadata)):
+        if not os.path.isdir(folder):
+            # sys.exit prints the message to stderr and exits with status 1
+            sys.exit(f"ingest: the {name} folder '{folder}' does not exist")
+    os.makedirs(args.output, exist_ok=True)
+    output_path = os.path.join(args.output, "filtered_reviews.csv")
+    columnar_path = os.path.join(args.output, "filtered_reviews.parquet") if args.parquet else None
+    rows = process_reviews_folder(args.input, args.metadata, jobs=args.jobs, columnar_path=columnar_path,
+                                  backend=args.backend, output_path=output_path, dedup=not args.keep_duplicates)
+    print(f"Wrote {sum(rows.values())} reviews from {len(rows)} files to {output_path}")
+
+def generate(args):
+    '''
+    Writes synthetic review and metadata folders into the output folder (synthetic_data.py)
+    '''
+    from synthetic_data import generate_dataset
+    review_dir, meta_dir = generate_dataset(args.output, args.reviews, args.categories, args.seed,
+                                            args.duplicate_rate, args.gzip)
+    print(f"Wrote {args.reviews} reviews to {review_dir} and their metadata to {meta_dir}")
+
+def sample(args):
+    '''
+    Writes a seeded stratified sample of the parsed csv file (data_parser.sample_reviews)
+    '''
+    from data_parser import sample_reviews
+    sample_reviews(args.input, args.output, args.size, args.seed)
+
+def aggregate(args):
+    '''
+    Runs the asked for analyses in one scan and writes <output>/<analysis>.json for each
+    '''
+    from cache import cached_scan
+    os.makedirs(args.output, exist_ok=True)
+    aggregators = {name: _make_aggregator(name, args.words, args.capacity) for name in args.analyses}
+    results = cached_scan(args.input, aggregators, _open_cache(args), jobs=args.jobs)
+    for name, result in results.items():
+        path = os.path.join(args.output, name + ".json")
+        with open(path, 'w', encoding='UTF8') as f:
+            json.dump(_to_json(name, result), f, indent=1)
+        print(f"Wrote {path}")
+
+def corpus(args):
+    '''
+    Encodes the review texts as token ids into the output folder (corpus_store.py)
+    '''
+    from corpus_store import build_corpus
+    reviews = build_corpus(args.input, args.output)
+    print(f"Wrote the tokens of {reviews} reviews to {args.output}")
+
+def query(args):
+    '''
+    Counts (and with --rows prints) the reviews that use all of the terms, using the
+    inverted index of the csv file (inverted_index.py, built on first use)
+    '''
+    from inverted_index import open_index
+    verified = None if args.verified is None else args.verified == "true"
+    with open_index(args.input, args.index_dir or args.input + ".index") as index:
+        ids = index.query(args.terms, args.category, args.rating, verified)
+        print(f"{len(ids)} reviews")
+        if args.rows:
+            writer = csv.writer(sys.stdout)
+            writer.writerow(index.meta["header"])
+            writer.writerows(index.rows(ids[:args.rows], args.input))
+
+def plot(args):
+    '''
+    Saves the charts of main.py into the output folder (render.py), or shows them one at
+    a time with --show
+    '''
+    if not args.show:
+        from render import render_all
+        render_all(args.input, args.output, jobs=args.jobs, charts=args.charts, cache=_open_cache(args),
+                   scan_jobs=args.jobs)
+        return
+    import main
+    os.makedirs(args.output, exist_ok=True)
+    if args.charts == "all":
+        main.report_main(jobs=args.jobs, filename=args.input, plots_dir=args.output, cache=_open_cache(args))
+    elif args.charts == "connor":
+        main.connor_main(jobs=args.jobs, filename=args.input, cache=_open_cache(args), plots_dir=args.output)
+    elif args.charts == "zeyu":
+        main.zeyu_linxiao_main(chunksize=args.chunksize, filename=args.input, plots_dir=args.output)
+    else:
+        main.sahil_main(filename=args.input, plots_dir=args.output)
+
+def _add_cache_arguments(command):
+    command.add_argument("--cache-dir", default=None,
+                         help="reuse analysis results from this folder when the input did not change")
+    command.add_argument("--cache-mb", type=int, default=256, help="size limit of the cache folder in MB")
+
+def build_parser():
+    '''
+    returns - the argparse parser with the ingest, aggregate and plot subcommands
+    '''
+    parser = argparse.ArgumentParser(description="Amazon review analysis pipeline")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("ingest", help="parse the raw review and metadata files")
+    command.add_argument("input", help="folder with the *_5.json(.gz) review files")
+    command.add_argument("metadata", help="folder with the meta_*.json(.gz) files")
+    command.add_argument("-o", "--output", default=".", help="folder to write filtered_reviews.csv to")
+    command.add_argument("--jobs", type=int, default=1, help="number of worker processes")
+    command.add_argument("--backend", default=None, help="json backend: json, orjson, ujson, simdjson or auto")
+    command.add_argument("--parquet", action="store_true", help="also write filtered_reviews.parquet (needs pyarrow)")
+    command.add_argument("--keep-duplicates", action="store_true",
+                         help="keep reviews with the same reviewer, product and text as an earlier one")
+    command.set_defaults(run=ingest)
+
+    command = commands.add_parser("generate", help="write synthetic review and metadata files for testing")
+    command.add_argument("-o", "--output", default="synthetic_data", help="folder to write reviews/ and metadata/ to")
+    command.add_argument("--reviews", type=int, default=100000, help="total number of reviews")
+    command.add_argument("--categories", nargs="+", default=None, help="category names, e.g. AMAZON_FASHION")
+    command.add_argument("--seed", type=int, default=0)
+    command.add_argument("--duplicate-rate", type=float, default=0.01, help="share of repeated reviews")
+    command.add_argument("--gzip", action="store_true", help="write .json.gz files")
+    command.set_defaults(run=generate)
+
+    command = commands.add_parser("sample", help="write a smaller dataset with the same category and rating mix")
+    command.add_argument("input", help="the parsed csv file")
+    command.add_argument("-o", "--output", default="truncated_filtered_reviews.csv", help="csv file to write")
+    command.add_argument("--size", type=int, default=100000, help="number of reviews to sample")
+    command.add_argument("--seed", type=int, default=0, help="the same seed always gives the same sample")
+    command.set_defaults(run=sample)
+
+    command = commands.add_parser("aggregate", help="run the analyses and write the results as json")
+    command.add_argument("input", help="the parsed csv or .parquet file")
+    command.add_argument("-o", "--output", default=".", help="folder to write the json files to")
+    command.add_argument("--jobs", type=int, default=1, help="number of worker processes")
+    command.add_argument("--analyses", nargs="+", choices=ANALYSES, default=["verified", "words"])
+    command.add_argument("--words", nargs="+", default=["good", "comfortable"], help="words for word-usage")
+    command.add_argument("--capacity", type=int, default=None,
+                         help="count the words approximately with this many counters (see sketches.py)")
+    _add_cache_arguments(command)
+    command.set_defaults(run=aggregate)
+
+    command = commands.add_parser("corpus", help="encode the review texts as token ids for the word analyses")
+    command.add_argument("input", help="the parsed csv or .parquet file")
+    command.add_argument("-o", "--output", default="corpus_store", help="folder to write the arrays to")
+    command.set_defaults(run=corpus)
+
+    command = commands.add_parser("query", help="find the reviews that use some words")
+    command.add_argument("input", help="the parsed csv file")
+    command.add_argument("terms", nargs="*", help="words that all have to be in the review")
+    command.add_argument("--category", default=None, help="only this Source Category, e.g. AMAZON_FASHION_5.json")
+    command.add_argument("--rating", type=float, default=None)
+    command.add_argument("--verified", choices=["true", "false"], default=None)
+    command.add_argument("--rows", type=int, default=0, help="also print the first ROWS matching rows")
+    command.add_argument("--index-dir", default=None, help="folder of the index, <input>.index if not given")
+    command.set_defaults(run=query)
+
+    command = commands.add_parser("plot", help="make the charts")
+    command.add_argument("input", help="the parsed csv or .parquet file")
+    command.add_argument("-o", "--output", default="temp_plots/", help="folder to save the charts to")
+    command.add_argument("--jobs", type=int, default=1, help="number of worker processes")
+    command.add_argument("--charts", choices=CHARTS, default="all")
+    command.add_argument("--show", action="store_true", help="show the charts instead of saving them")
+    command.add_argument("--chunksize", type=int, default=None, help="read the data in chunks (zeyu charts with --show)")
+    _add_cache_arguments(command)
+    command.set_defaults(run=plot)
+    return parser
+
+def run(argv=None):
+    '''
+    params:
+    argv - the command line arguments, sys.argv[1:] if not given
+    '''
+    args = build_parser().parse_args(argv)
+    if getattr(args, "jobs", 1) < 1:
+        build_parser().error("--jobs must be at least 1")
+    args.run(args)
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
@@ -0,0 +1,90 @@
+'''
+columnar.py - writes the parsed review data as a typed Parquet file so the analysis
+code can load the columns directly instead of re-parsing filtered_reviews.csv
+
+Only imported by data_parser.py when columnar output is asked for, so pyarrow is
+not needed for the normal csv output.
+'''
+import pyarrow as pa #3rd-party
+import pyarrow.parquet as pq #3rd-party
+from data_parser import price_to_float, CSV_HEADER
+
+# The csv columns (see data_parser.CSV_HEADER) plus the parsed "Price"
+SCHEMA = pa.schema([
+    ("Source Category", pa.dictionary(pa.int32(), pa.string())),
+    ("Product ID", pa.string()),
+    ("Reviewer ID", pa.string()),
+    ("Rating", pa.int8()),
+    ("Review Summary", pa.string()),
+    ("Review Text", pa.string()),
+    ("Verified", pa.bool_()),
+    ("Has Image", pa.bool_()),
+    ("Product Price", pa.string()),
+    ("Price", pa.float64()),
+])
+
+def _to_bool(value):
+    '''
+    Booleans come in as bools from the json parser and as strings from the csv part files
+    '''
+    if isinstance(value, bool):
+        return value
+    if value == "True" or value == "False":
+        return value == "True"
+    return None
+
+def _to_rating(value):
+    try:
+        return int(float(value))
+    except (ValueError, TypeError):
+        return None
+
+def _to_text(value):
+    '''
+    The parser writes "N/A" for missing fields, which pd.read_csv also reads as missing
+    '''
+    return None if value is None or value == "N/A" else str(value)
+
+# how the csv values of the typed columns are converted, the others are text
+CONVERTERS = {"Rating": _to_rating, "Verified": _to_bool, "Has Image": _to_bool, "Price": lambda price: price}
+
+class ColumnarWriter:
+    '''
+    Drop-in replacement for csv.writer that buffers the parsed rows and writes them
+    to a Parquet file one row group at a time
+    params:
+    path - the Parquet file to write
+    batch_size - number of rows per row group
+    '''
+    def __init__(self, path, batch_size=100000):
+        assert(isinstance(path, str))
+        assert(isinstance(batch_size, int) and batch_size > 0)
+        self.batch_size = batch_size
+        self.columns = [[] for _ in SCHEMA]
+        self.writer = pq.ParquetWriter(path, SCHEMA)
+
+    def writerow(self, row):
+        '''
+        Adds one row in the parser's column order (data_parser.CSV_HEADER, without the parsed "Price")
+        '''
+        assert(len(row) == len(CSV_HEADER))
+        values = dict(zip(CSV_HEADER, row))
+        values["Price"] = price_to_float(values["Product Price"])
+        for column, field in zip(self.columns, SCHEMA):
+            column.append(CONVERTERS.get(field.name, _to_text)(values[field.name]))
+        if len(self.columns[0]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes the buffered rows out as a row group
+        '''
+        if len(self.columns[0]) == 0:
+            return
+        arrays = [pa.array(column, type=field.type) for column, field in zip(self.columns, SCHEMA)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=SCHEMA))
+        self.columns = [[] for _ in SCHEMA]
+
+    def close(self):
+        self.flush()
+        self.writer.close()
@@ -0,0 +1,225 @@
+'''
+corpus_store.py - the review texts encoded once as integer token ids
+
+build_corpus tokenizes every review a single time (see tokenizer.py, stopwords kept) and
+writes the corpus into a folder as flat binary arrays:
+    meta.json       - the vocabulary (word of each id, in order of first use), the
+                      category names and the size/modification time of the source file
+    tokens.int32    - the token ids of all reviews one after the other
+    offsets.int64   - where each review starts in tokens (CSR style, one more than the
+                      number of reviews so review i is tokens[offsets[i]:offsets[i + 1]])
+    category.int32  - the category id of each review
+    rating.int8     - the rating of each review
+The arrays are opened as numpy memmaps, so the word analyses below run over integer
+arrays without reading or tokenizing the review text again.
+'''
+import os
+import json
+from array import array
+from collections import Counter
+import numpy as np #3rd-party
+from scan_engine import iter_rows, review_text, rating_key
+from tokenizer import tokenize, get_stopwords
+
+META_FILE = "meta.json"
+ARRAYS = {"tokens": "int32", "offsets": "int64", "category": "int32", "rating": "int8"}
+
+def _source_stamp(filename):
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _array_path(store_dir, name):
+    return os.path.join(store_dir, f"{name}.{ARRAYS[name]}")
+
+def build_corpus(filename, store_dir, flush_tokens=1 << 20):
+    '''
+    Encodes the review texts of the parsed data into store_dir
+    params:
+    filename - the parsed csv file or the .parquet file from data_parser
+    store_dir - folder to write the arrays to, created if needed
+    flush_tokens - number of token ids buffered before they are written out
+    returns - number of reviews
+    '''
+    assert(isinstance(filename, str) and isinstance(store_dir, str))
+    os.makedirs(store_dir, exist_ok=True)
+    word_ids = {}
+    category_ids = {}
+    offsets = array('q', [0])
+    categories = array('i')
+    ratings = array('b')
+    tokens = array('i')
+    total = 0
+    rows = iter_rows(filename)
+    columns = {name: i for i, name in enumerate(next(rows))}
+    text_column, category_column, rating_column = (columns["Review Text"], columns["Source Category"],
+                                                   columns["Rating"])
+    with open(_array_path(store_dir, "tokens") + ".tmp", 'wb') as token_file:
+        for row in rows:
+            words = tokenize(review_text(row[text_column]), remove_stopwords=False)
+            for word in words:
+                word_id = word_ids.get(word)
+                if word_id is None:
+                    word_id = word_ids[word] = len(word_ids)
+                tokens.append(word_id)
+            total += len(words)
+            offsets.append(total)
+            if len(tokens) >= flush_tokens:
+                tokens.tofile(token_file)
+                tokens = array('i')
+            category = row[category_column]
+            if category not in category_ids:
+                category_ids[category] = len(category_ids)
+            categories.append(category_ids[category])
+            ratings.append(int(float(row[rating_column])))
+        tokens.tofile(token_file)
+    for name, values in (("offsets", offsets), ("category", categories), ("rating", ratings)):
+        with open(_array_path(store_dir, name) + ".tmp", 'wb') as f:
+            values.tofile(f)
+    for name in ARRAYS:
+        os.replace(_array_path(store_dir, name) + ".tmp", _array_path(store_dir, name))
+    meta = {"source": _source_stamp(filename), "reviews": len(categories), "tokens": total,
+            "vocab": list(word_ids), "categories": list(category_ids)}
+    with open(os.path.join(store_dir, META_FILE), 'w', encoding='UTF8') as f:
+        json.dump(meta, f)
+    return len(categories)
+
+class CorpusStore:
+    '''
+    Read access to a built corpus, the arrays are memory-mapped
+    params:
+    store_dir - folder written by build_corpus
+    '''
+    def __init__(self, store_dir):
+        assert(isinstance(store_dir, str))
+        with open(os.path.join(store_dir, META_FILE), 'r', encoding='UTF8') as f:
+            self.meta = json.load(f)
+        self.vocab = self.meta["vocab"]
+        self.word_ids = {word: i for i, word in enumerate(self.vocab)}
+        self.categories = self.meta["categories"]
+        for name, dtype in ARRAYS.items():
+            path = _array_path(store_dir, name)
+            # np.memmap can not map an empty file
+            if os.path.getsize(path) == 0:
+                setattr(self, name, np.zeros(0, dtype=dtype))
+            else:
+                setattr(self, name, np.memmap(path, dtype=dtype, mode='r'))
+
+    def __len__(self):
+        return len(self.category)
+
+    def review_mask(self, category=None, rating=None):
+        '''
+        params:
+        category - only the reviews of this category (name), or all
+        rating - only the reviews with this rating, or all
+        returns - boolean array with one entry per review
+        '''
+        mask = np.ones(len(self), dtype=bool)
+        if category is not None:
+            if category not in self.categories:
+                return np.zeros(len(self), dtype=bool)
+            mask &= self.category == self.categories.index(category)
+        if rating is not None:
+            mask &= self.rating == int(float(rating))
+        return mask
+
+    def token_mask(self, review_mask):
+        '''
+        Turns a mask over the reviews into a mask over their tokens
+        '''
+        return np.repeat(review_mask, np.diff(self.offsets))
+
+def open_corpus(filename, store_dir):
+    '''
+    Opens the corpus of the parsed data, building it first if it is missing or out of date
+    params:
+    filename - the parsed csv file or the .parquet file from data_parser
+    store_dir - folder of the corpus
+    returns - CorpusStore
+    '''
+    assert(isinstance(filename, str) and isinstance(store_dir, str))
+    try:
+        store = CorpusStore(store_dir)
+        if store.meta["source"] == _source_stamp(filename):
+            return store
+    except (OSError, ValueError, KeyError):
+        pass
+    print(f"Building corpus store: {store_dir}")
+    build_corpus(filename, store_dir)
+    return CorpusStore(store_dir)
+
+def word_freq(store, top=100, mask=None):
+    '''
+    Finds the counts of each word in the review texts without the stopwords, like
+    main.word_freq but with one np.bincount over the token ids
+    params:
+    store - CorpusStore
+    top - number of most common words to return
+    mask - optional boolean array selecting the reviews to count (see review_mask)
+    returns - dict of word -> count of the top most common words
+    '''
+    tokens = store.tokens if mask is None else store.tokens[store.token_mask(mask)]
+    counts = np.bincount(tokens, minlength=len(store.vocab))
+    for word in get_stopwords():
+        if word in store.word_ids:
+            counts[store.word_ids[word]] = 0
+    # ids are in order of first use, so the stable sort breaks ties like Counter.most_common
+    order = np.argsort(-counts, kind='stable')[:top]
+    return {store.vocab[i]: int(counts[i]) for i in order if counts[i] > 0}
+
+def _word_positions(store, word, mask=None):
+    '''
+    returns - (positions of word, positions of "not word") in tokens, a "not" at the end
+              of one review and the word at the start of the next do not count
+    '''
+    word_id = store.word_ids.get(word)
+    if word_id is None:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    is_word = store.tokens == word_id
+    if mask is not None:
+        is_word &= store.token_mask(mask)
+    positions = np.flatnonzero(is_word)
+    not_id = store.word_ids.get("not")
+    if not_id is None:
+        return positions, positions[:0]
+    # the word follows a "not" of the same review (position - 1 is not the end of the previous review)
+    follows = positions[positions > 0]
+    follows = follows[store.tokens[follows - 1] == not_id]
+    starts = np.asarray(store.offsets[1:-1])
+    follows = follows[~np.isin(follows, starts)]
+    return positions, follows
+
+def count_word_occurrences(store, word, mask=None):
+    '''
+    Counts a word and its "not <word>" form, like main.count_word_occurrences, over the
+    token ids
+    params:
+    store - CorpusStore
+    word - the word to count
+    mask - optional boolean array selecting the reviews to count (see review_mask)
+    returns - Counter with "good", "not good" and "total_words"
+    '''
+    positions, negated = _word_positions(store, word, mask)
+    total = len(store.tokens) if mask is None else int(np.diff(store.offsets)[mask].sum())
+    return Counter({"good": len(positions), "not good": len(negated), "total_words": total})
+
+def word_usage_by_category_and_rating(store, word):
+    '''
+    Counts a word and its "not <word>" form in the reviews of every category and rating,
+    the same result as scan_engine.WordUsageAggregator for one word
+    params:
+    store - CorpusStore
+    word - the word to count
+    returns - dict of (category, rating) -> {"good": count, "not good": count}
+    '''
+    # one cell per (category, rating), ratings are 1 to 5
+    cells = store.category.astype(np.int64) * 6 + store.rating
+    positions, negated = _word_positions(store, word)
+    review_of = np.searchsorted(store.offsets, np.concatenate([positions, negated]), side='right') - 1
+    good = np.bincount(cells[review_of[:len(positions)]], minlength=len(store.categories) * 6)
+    not_good = np.bincount(cells[review_of[len(positions):]], minlength=len(store.categories) * 6)
+    usage = {}
+    for cell in np.unique(cells):
+        key = (store.categories[cell // 6], rating_key(float(cell % 6)))
+        usage[key] = {"good": int(good[cell]), "not good": int(not_good[cell])}
+    return usage
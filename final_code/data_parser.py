@@ -9,31 +9,83 @@ GitHub repository since the file sizes are too large.
 '''
 import json
 import csv
+import gzip
 import os
+import shutil
+import hashlib
+import random
+import multiprocessing
+from metadata_index import open_price_index
+from json_backends import make_projector
 
-def parse_json_file(filepath, file_name):
+# The only fields read from the review and metadata json objects
+REVIEW_FIELDS = ('asin', 'reviewerID', 'overall', 'summary', 'reviewText', 'verified', 'image')
+METADATA_FIELDS = ('asin', 'price')
+# Columns of the parsed csv file, in the order parse_json_file and the price lookup write them
+CSV_HEADER = ("Source Category", "Product ID", "Reviewer ID", "Rating", "Review Summary", "Review Text",
+              "Verified", "Has Image", "Product Price")
+
+# rough size of a review line, only used to size the duplicate filter
+DEDUP_BYTES_PER_REVIEW = 300
+
+def open_json_lines(filepath):
+    '''
+    Opens a json lines file for reading. Files ending in .gz (the way the dataset is
+    distributed) are decompressed on the fly instead of having to be unpacked first
+    param:
+    filepath - path to a .json or .json.gz file
+    returns - text file object
+    '''
+    assert(isinstance(filepath, str))
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, 'rt', encoding='UTF8')
+    return open(filepath, 'r', encoding='UTF8')
+
+def iter_json_lines(filepath, decode=json.loads):
+    '''
+    Reads a json lines file one line at a time so memory use does not depend on the file size
+    param:
+    filepath - path to a .json or .json.gz file
+    decode - function used to decode each line (see json_backends.py)
+    yields - each decoded json object
+    '''
+    with open_json_lines(filepath) as f:
+        for line in f:
+            if len(line.strip()) > 0:
+                yield decode(line)
+
+def parse_json_file(filepath, file_name, backend=None):
     '''
     Parses an Amazon review data "json" file
     param:
     filepath - path to amazon review data files
     file_name - name of the file. Used for the categories. 
+    backend - json backend name (see json_backends.py), defaults to the standard library
     yields - csv formatted review data
     '''
     assert(isinstance(filepath, str) and isinstance(file_name, str))
-    with open(filepath, 'r', encoding='UTF8') as f:
-        items = f.read().split('\n')
-        for item in items:
-            if len(item) > 0:
-                item = json.loads(item)
-                outputList = [file_name, #"Source Category"
-                            getKey(item,'asin'), #"Product ID"
-                            getKey(item,'reviewerID'), #"Reviewer ID"
-                            getKey(item,'overall'), #"Rating"
-                            getKey(item,'summary'), #"Review Summary"
-                            getKey(item,'reviewText'), #"Review Text"
-                            getKey(item,'verified')]
-                outputList.append("image" in item.keys()) #"Has Image"
-                yield outputList
+    for item in iter_json_lines(filepath, make_projector(REVIEW_FIELDS, backend)):
+        outputList = [file_name, #"Source Category"
+                    getKey(item,'asin'), #"Product ID"
+                    getKey(item,'reviewerID'), #"Reviewer ID"
+                    getKey(item,'overall'), #"Rating"
+                    getKey(item,'summary'), #"Review Summary"
+                    getKey(item,'reviewText'), #"Review Text"
+                    getKey(item,'verified')] #"Verified"
+        outputList.append("image" in item.keys()) #"Has Image"
+        yield outputList
+
+def iter_metadata(filepath, backend=None):
+    '''
+    Streams the metadata information one product at a time
+    params:
+    filepath - filepath to metadata
+    backend - json backend name (see json_backends.py), defaults to the standard library
+    yields - (product id, price) tuples
+    '''
+    assert(isinstance(filepath, str))
+    for item in iter_json_lines(filepath, make_projector(METADATA_FIELDS, backend)):
+        yield getKey(item,"asin"), getKey(item,"price")
 
 def load_metadata(filepath):
     '''
@@ -42,14 +94,10 @@ def load_metadata(filepath):
     filepath - filepath to metadata
     '''
     assert(isinstance(filepath, str))
-    with open(filepath, 'r', encoding="UTF8") as f:
-        items = f.read().split('\n')
-        returnDict = {}
-        for item in items:
-            if len(item) > 0:
-                item = json.loads(item)
-                returnDict[getKey(item,"asin")] = getKey(item,"price")
-        return returnDict
+    returnDict = {}
+    for asin, price in iter_metadata(filepath):
+        returnDict[asin] = price
+    return returnDict
 
 def find_metadata(metadict, asin):
     '''
@@ -75,38 +123,340 @@ def getKey(mydict,key):
     except KeyError:
         return "N/A"
 
-def process_reviews_folder(folder_path, meta_path):
+def price_to_float(price):
+    '''
+    Converts a metadata price string to a float, averaging ranges. Follows the same
+    rules as handle_price in main.py but returns NaN instead of pd.NA
+    param:
+    price - the price value to convert
+    returns - float
+    '''
+    if isinstance(price, float):
+        return price
+    try:
+        price_str = str(price).replace('$', '').replace(' ', '').replace('–', '-')
+        if '-' in price_str:
+            numbers = list(map(float, price_str.split('-')))
+            return sum(numbers) / len(numbers)
+        return float(price_str)
+    except (ValueError, TypeError):
+        return float('nan')
+
+def _metadata_file(meta_path, filename):
+    '''
+    Finds the metadata file that belongs to a review file
+    params:
+    meta_path - path to the metadata folder
+    filename - name of the review data file (with the .gz suffix already removed)
+    returns - path of meta_<category>.json, or meta_<category>.json.gz if only that exists
+    '''
+    category = filename.split("_5")[0]+".json"
+    metapath = meta_path+"/meta_"+category
+    if not os.path.exists(metapath) and os.path.exists(metapath+".gz"):
+        metapath += ".gz"
+    return metapath
+
+def _write_category_rows(writer, file_path, filename, meta_path, backend=None, batch_size=10000, dedup=True,
+                         index_dir=None):
+    '''
+    Parses a single review file, attaches the product prices and writes the rows
+    params:
+    writer - csv writer to write the rows to
+    file_path - path to the review data file
+    filename - name of the review data file. Used for the categories.
+    meta_path - path to the metadata folder
+    backend - json backend name
+    batch_size - number of rows to look up prices for at once
+    dedup - skip the reviews with the same reviewer, product and text as an earlier
+            review of the file (see dedup.py)
+    index_dir - folder for the price index of the metadata file (see metadata_index.py),
+                the metadata folder if not given
+    returns - (the number of rows written, the number of duplicate rows skipped)
+    '''
+    if filename.endswith('.gz'):
+        # keep the Source Category the same as for the uncompressed files
+        filename = filename[:-3]
+    metapath = _metadata_file(meta_path, filename)
+    rows = 0
+    deduplicator = None
+    if dedup:
+        # imported here so numpy is only loaded when parsing
+        from dedup import ReviewDeduplicator
+        # sized from the file size, about one review per DEDUP_BYTES_PER_REVIEW bytes
+        expected = os.path.getsize(file_path) // DEDUP_BYTES_PER_REVIEW * (4 if file_path.endswith('.gz') else 1)
+        deduplicator = ReviewDeduplicator(expected)
+    # prices come from the persistent index instead of a dict of the whole metadata file
+    with open_price_index(metapath, lambda path: iter_metadata(path, backend), index_dir) as index:
+        batch = []
+        for outputList in parse_json_file(file_path, filename, backend):
+            batch.append(outputList)
+            if len(batch) >= batch_size:
+                rows += _write_priced_rows(writer, index, _drop_duplicates(deduplicator, batch))
+                batch = []
+        rows += _write_priced_rows(writer, index, _drop_duplicates(deduplicator, batch))
+    if deduplicator is None:
+        return rows, 0
+    deduplicator.close()
+    return rows, deduplicator.duplicates
+
+def _drop_duplicates(deduplicator, batch):
+    '''
+    Removes the rows of a batch whose reviewer, product and text were seen before
+    '''
+    if deduplicator is None:
+        return batch
+    duplicates = deduplicator.find_duplicates([(outputList[2], outputList[1], outputList[5]) for outputList in batch])
+    return [outputList for outputList, duplicate in zip(batch, duplicates) if not duplicate]
+
+def _write_priced_rows(writer, index, batch):
+    '''
+    Looks up the prices for a batch of parsed rows and writes them
+    returns - the number of rows written
+    '''
+    prices = index.lookup(outputList[1] for outputList in batch)
+    for outputList in batch:
+        outputList.append(getKey(prices, outputList[1]))
+        writer.writerow(outputList)
+    return len(batch)
+
+def _parse_category_file(task):
+    '''
+    Parses one review file (and loads its own metadata) into a headerless part csv file.
+    Runs in a worker process in the parallel mode of process_reviews_folder
+    params:
+    task - tuple of (file_path, filename, meta_path, backend, part_path, dedup, index_dir)
+    returns - (the number of rows written, the number of duplicate rows skipped)
+    '''
+    file_path, filename, meta_path, backend, part_path, dedup, index_dir = task
+    print(f"Processing file: {filename}")
+    # written under a temporary name so an interrupted run never leaves a partial part behind
+    with open(part_path + ".tmp", "w", encoding="UTF8") as w:
+        writer = csv.writer(w, lineterminator="\n")
+        rows, duplicates = _write_category_rows(writer, file_path, filename, meta_path, backend, dedup=dedup,
+                                                  index_dir=index_dir)
+    os.replace(part_path + ".tmp", part_path)
+    if duplicates:
+        print(f"Dropped {duplicates} duplicate reviews from {filename}")
+    return rows, duplicates
+
+def file_digest(filepath):
+    '''
+    sha256 of a file's contents, read in blocks
+    params:
+    filepath - path to the file
+    returns - hex digest string
+    '''
+    assert(isinstance(filepath, str))
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _file_entry(filepath, previous=None):
+    '''
+    Describes a file for the manifest. The content hash is only recomputed when the size
+    or modification time differ from the previous entry
+    params:
+    filepath - path to the file
+    previous - the file's entry from the last run, if any
+    returns - dict with name, size, mtime and sha256, or None if the file does not exist
+    '''
+    if not os.path.exists(filepath):
+        return None
+    stat = os.stat(filepath)
+    entry = {"name": os.path.basename(filepath), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if previous is not None and all(previous.get(key) == entry[key] for key in ("name", "size", "mtime")):
+        entry["sha256"] = previous["sha256"]
+    else:
+        entry["sha256"] = file_digest(filepath)
+    return entry
+
+def _same_content(entry, previous):
+    if entry is None or previous is None:
+        return entry is previous
+    return entry["name"] == previous["name"] and entry["sha256"] == previous["sha256"]
+
+def load_manifest(output_path):
+    '''
+    Reads the manifest of the files that went into an output file
+    params:
+    output_path - path to the parsed csv file
+    returns - dict of review file name -> {"review", "metadata", "rows", "part", "dedup", "duplicates"}
+    '''
+    assert(isinstance(output_path, str))
+    manifest_path = output_path + ".manifest.json"
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="UTF8") as f:
+        return json.load(f)["files"]
+
+def _save_manifest(output_path, files):
+    manifest_path = output_path + ".manifest.json"
+    with open(manifest_path + ".tmp", "w", encoding="UTF8") as f:
+        json.dump({"files": files}, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+def process_reviews_folder(folder_path, meta_path, jobs=1, columnar_path=None, backend=None,
+                           output_path="filtered_reviews.csv", dedup=True):
     '''
     processes the entire folder of review data
+
+    The rows of every review file are kept in their own part file in <output_path>.parts
+    and <output_path>.manifest.json records the name, size, modification time, content
+    hash and row count of each review file and its metadata file. A re-run only parses
+    the review files that are new or whose review or metadata file changed, drops the
+    parts of files that were removed, and then rebuilds the output from the parts. The
+    price index of every metadata file (see metadata_index.py) is kept in
+    <output_path>.price_index, so the input folders are only read.
     param:
     folder_path - the path to the folder with the review data
     meta_path - path to the metadata folder
+    jobs - number of worker processes to parse the category files with. The rows are
+           always written in sorted file name order so the output does not depend on it
+    columnar_path - optional path of a typed Parquet file to also write the rows to
+                    (see columnar.py, needs pyarrow)
+    backend - json backend used to decode the files: "json" (the default), "orjson",
+              "ujson", "simdjson" or "auto" for the fastest one installed
+    output_path - path of the csv file to write
+    dedup - drop repeated reviews (same reviewer, product and text) within each review
+            file. The number dropped is printed and kept in the manifest
+    returns - dict of review file name -> number of rows, empty if folder_path does not exist
 
     ### DO NOT PUT THE METADATA FOLDERS INSIDE THE REVIEW DATA FOLDER!! METADATA SHOULD BE IN ITS OWN PATH
     '''
     assert(isinstance(folder_path, str) and isinstance(meta_path, str))
-    with open("filtered_reviews.csv", "a", encoding="UTF8") as w:
+    assert(isinstance(jobs, int) and jobs > 0)
+    assert(columnar_path is None or isinstance(columnar_path, str))
+    assert(isinstance(output_path, str))
+    # Check if the folder exists
+    if not os.path.exists(folder_path):
+        print(f"The folder '{folder_path}' does not exist.")
+        return {}
+
+    parts_path = output_path + ".parts"
+    os.makedirs(parts_path, exist_ok=True)
+    # the price indexes are kept with the output, the input folders are only read
+    index_path = output_path + ".price_index"
+    previous = load_manifest(output_path)
+
+    # Collect each review file in the folder, sorted so the output order is deterministic
+    files = {}
+    tasks = []
+    for filename in sorted(os.listdir(folder_path)):
+        file_path = os.path.join(folder_path, filename)
+
+        # Check if the item is a file and ends with .json (or is a gzipped .json)
+        if not (os.path.isfile(file_path) and filename.endswith(('.json', '.json.gz'))):
+            continue
+        old = previous.get(filename, {})
+        part = filename + ".csv"
+        review = _file_entry(file_path, old.get("review"))
+        metadata = _file_entry(_metadata_file(meta_path, filename[:-3] if filename.endswith('.gz') else filename),
+                               old.get("metadata"))
+        files[filename] = {"review": review, "metadata": metadata, "rows": old.get("rows"), "part": part,
+                           "dedup": dedup, "duplicates": old.get("duplicates", 0)}
+        if (old and _same_content(review, old["review"]) and _same_content(metadata, old["metadata"])
+                and old.get("dedup", False) == dedup and os.path.exists(os.path.join(parts_path, part))):
+            print(f"Unchanged, reusing rows: {filename}")
+        else:
+            tasks.append((file_path, filename, meta_path, backend, os.path.join(parts_path, part), dedup, index_path))
+
+    # Parse the new and changed files, in a process pool if asked for
+    if jobs == 1 or len(tasks) <= 1:
+        counts = map(_parse_category_file, tasks)
+        for task, (rows, duplicates) in zip(tasks, counts):
+            files[task[1]]["rows"] = rows
+            files[task[1]]["duplicates"] = duplicates
+    else:
+        with multiprocessing.Pool(min(jobs, len(tasks))) as pool:
+            for task, (rows, duplicates) in zip(tasks, pool.imap(_parse_category_file, tasks)):
+                files[task[1]]["rows"] = rows
+                files[task[1]]["duplicates"] = duplicates
+    if dedup:
+        print(f"Dropped {sum(entry['duplicates'] for entry in files.values())} duplicate reviews in total")
+
+    # Drop the parts of review files that are no longer in the folder
+    for filename, entry in previous.items():
+        if filename not in files and os.path.exists(os.path.join(parts_path, entry["part"])):
+            print(f"Removing rows of deleted file: {filename}")
+            os.remove(os.path.join(parts_path, entry["part"]))
+    _save_manifest(output_path, files)
+
+    # Rebuild the outputs from the parts in file name order
+    with open(output_path, "w", encoding="UTF8") as w:
         writer = csv.writer(w, lineterminator="\n")
-        writer.writerow(["Source Category", "Product ID","Reviewer ID", "Rating", "Review Summary","Review Text", "Has Image", "Verified", "Product Price"])
-        # Check if the folder exists
-        if not os.path.exists(folder_path):
-            print(f"The folder '{folder_path}' does not exist.")
-            return
-
-        # Iterate through each file in the folder
-        for filename in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, filename)
-
-            # Check if the item is a file and ends with .json
-            if os.path.isfile(file_path) and filename.endswith('.json'):
-                print(f"Processing file: {filename}")
-                # Process the JSON file
-                category = filename.split("_5")[0]+".json"
-                metapath = meta_path+"/meta_"+category
-                metadict = load_metadata(metapath)
-                for outputList in parse_json_file(file_path, filename):
-                    price = find_metadata(metadict, outputList[1])
-                    outputList.append(price)
-                    writer.writerow(outputList)
-
-process_reviews_folder("./reviews")
+        writer.writerow(CSV_HEADER)
+        for filename in files:
+            with open(os.path.join(parts_path, files[filename]["part"]), "r", encoding="UTF8") as part:
+                shutil.copyfileobj(part, w)
+    if columnar_path is not None:
+        # imported here so pyarrow is only needed when columnar output is asked for
+        from columnar import ColumnarWriter
+        columnar = ColumnarWriter(columnar_path)
+        try:
+            for filename in files:
+                with open(os.path.join(parts_path, files[filename]["part"]), "r", encoding="UTF8", newline="") as part:
+                    for row in csv.reader(part):
+                        columnar.writerow(row)
+        finally:
+            columnar.close()
+    return {filename: files[filename]["rows"] for filename in files}
+
+def sample_reviews(input_path, output_path, sample_size, seed=0):
+    '''
+    Writes a stratified random sample of a parsed csv file, e.g. to make a small dataset
+    like truncated_filtered_reviews.csv that still has the proportions of the full data.
+
+    Every (Source Category, Rating) group gets its share of sample_size (rounded by
+    largest remainder, so the shares add up to sample_size). The first pass over the file
+    only counts the rows of every group. The second pass copies the rows with selection
+    sampling: a row is kept with probability (rows its group still needs) / (rows of its
+    group not seen yet), which picks exactly its share as a uniform sample of the group
+    and writes the rows in their order in the input. Only two counts per group are kept in
+    memory. The same seed always gives the same sample.
+    params:
+    input_path - the parsed csv file from process_reviews_folder
+    output_path - path of the csv file to write
+    sample_size - number of rows to write, all rows if the input has fewer
+    seed - seed of the random numbers
+    returns - dict of (category, rating) -> number of rows sampled
+    '''
+    assert(isinstance(input_path, str) and isinstance(output_path, str))
+    assert(isinstance(sample_size, int) and sample_size > 0)
+    rng = random.Random(seed)
+    totals = {}
+    with open(input_path, "r", encoding="UTF8", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        category_column, rating_column = header.index("Source Category"), header.index("Rating")
+        for row in reader:
+            group = (row[category_column], row[rating_column])
+            totals[group] = totals.get(group, 0) + 1
+
+    # share of each group, the rows left over by rounding down go to the largest remainders
+    total = sum(totals.values())
+    shares = {group: sample_size * count / total for group, count in totals.items()}
+    counts = {group: min(int(share), totals[group]) for group, share in shares.items()}
+    left = min(sample_size, total) - sum(counts.values())
+    for group in sorted(shares, key=lambda group: shares[group] - int(shares[group]), reverse=True)[:left]:
+        counts[group] += 1
+
+    # rows each group still needs, and its rows not seen yet
+    needed = dict(counts)
+    remaining = dict(totals)
+    with open(input_path, "r", encoding="UTF8", newline="") as f, open(output_path, "w", encoding="UTF8") as w:
+        reader = csv.reader(f)
+        writer = csv.writer(w, lineterminator="\n")
+        writer.writerow(next(reader))
+        for row in reader:
+            group = (row[category_column], row[rating_column])
+            if rng.random() * remaining[group] < needed[group]:
+                writer.writerow(row)
+                needed[group] -= 1
+            remaining[group] -= 1
+    print(f"Sampled {sum(counts.values())} of {total} reviews from {len(counts)} category and rating groups")
+    return counts
+
+if __name__ == "__main__":
+    process_reviews_folder("./reviews", "./metadata")
@@ -0,0 +1,124 @@
+'''
+dedup.py - finds repeated reviews while the review files are parsed
+
+A review is identified by a 16 byte hash of its reviewer, product and text. Every hash
+goes into a Bloom filter, a bit array that answers "definitely new" for almost every
+new review using a few bits per review. Only when the filter answers "maybe seen"
+(a real duplicate, or a false positive with probability error_rate) is the exact set of
+hashes checked. The exact set is kept in a temporary SQLite database, so it can spill to
+disk instead of holding every hash of a large category in memory.
+
+The reviews are checked a batch at a time so the filter can be probed with numpy and the
+exact set with a few IN queries instead of once per review.
+'''
+import math
+import sqlite3
+import hashlib
+import numpy as np #3rd-party
+from metadata_index import query_in_batches
+
+class BloomFilter:
+    '''
+    params:
+    capacity - number of items expected, more items raise the false positive rate
+    error_rate - false positive rate at capacity items
+    '''
+    def __init__(self, capacity, error_rate=0.001):
+        assert(isinstance(capacity, int) and capacity > 0)
+        assert(0 < error_rate < 1)
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, digests):
+        # two 64 bit hashes of every item combined into as many as needed (Kirsch and Mitzenmacher)
+        halves = np.frombuffer(b"".join(digests), dtype='<u8').reshape(-1, 2)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            positions = halves[:, :1] + steps * (halves[:, 1:] | np.uint64(1))
+        return positions % np.uint64(self.size)
+
+    def add_many(self, digests):
+        '''
+        Adds items given as hashes of 16 bytes
+        params:
+        digests - list of the hashes
+        returns - boolean array, True where the item may have been added before (by an
+                  earlier call), False where it definitely was not
+        '''
+        if not digests:
+            return np.zeros(0, dtype=bool)
+        positions = self._positions(digests)
+        byte = (positions >> np.uint64(3)).astype(np.int64)
+        bit = (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8))
+        present = (self.bits[byte] & bit).all(axis=1)
+        np.bitwise_or.at(self.bits, byte.ravel(), bit.ravel())
+        return present
+
+class ReviewDeduplicator:
+    '''
+    Remembers the reviews seen so far and finds the ones that were seen before
+    params:
+    capacity - expected number of reviews, used to size the Bloom filter
+    error_rate - how often the exact set has to be checked for a new review
+    '''
+    def __init__(self, capacity, error_rate=0.001):
+        self.bloom = BloomFilter(max(int(capacity), 1000), error_rate)
+        # an empty file name is a private temporary database that is deleted on close
+        self.conn = sqlite3.connect("")
+        # nothing has to survive a crash, and a bigger page cache keeps the exact set in memory longer
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("PRAGMA cache_size = -65536")
+        self.conn.execute("CREATE TABLE seen (digest BLOB PRIMARY KEY) WITHOUT ROWID")
+        self.duplicates = 0
+
+    @staticmethod
+    def key(reviewer_id, product_id, text):
+        '''
+        returns - the 16 byte hash identifying a review
+        '''
+        return hashlib.blake2b("\x1f".join((str(reviewer_id), str(product_id), str(text))).encode('UTF8'),
+                               digest_size=16).digest()
+
+    def _known(self, digests):
+        '''
+        returns - the set of the digests that are in the exact set
+        '''
+        return {digest for (digest,) in query_in_batches(self.conn, "SELECT digest FROM seen WHERE digest IN (%s)", digests)}
+
+    def find_duplicates(self, reviews):
+        '''
+        Checks a batch of reviews and remembers them
+        params:
+        reviews - list of (reviewer id, product id, text)
+        returns - list with True for every review that was seen before (earlier in the
+                  batch or in an earlier batch)
+        '''
+        digests = [self.key(*review) for review in reviews]
+        duplicate = [False] * len(digests)
+        # the first time each review appears in this batch
+        first = {}
+        for i, digest in enumerate(digests):
+            if digest in first:
+                duplicate[i] = True
+            else:
+                first[digest] = i
+        new = list(first)
+        maybe = [digest for digest, present in zip(new, self.bloom.add_many(new)) if present]
+        if maybe:
+            for digest in self._known(maybe):
+                duplicate[first.pop(digest)] = True
+        # inserting in key order touches each page of the table once per batch
+        self.conn.executemany("INSERT INTO seen VALUES (?)", ((digest,) for digest in sorted(first)))
+        self.duplicates += sum(duplicate)
+        return duplicate
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
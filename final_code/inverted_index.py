@@ -0,0 +1,430 @@
+'''
+inverted_index.py - on disk inverted index over the reviews of the parsed csv file
+
+For every word (tokenized like everything else, see tokenizer.py) the index keeps the
+sorted numbers of the reviews that use it. The lists are stored as the differences
+between neighbouring review numbers written as varints (7 bits per byte, the high bit
+set on every byte but the last), which takes one byte per review for most words.
+Next to them the index keeps the category, rating and verified flag of every review
+and the byte offset of its row in the csv file, so a query like "reviews of
+AMAZON_FASHION with rating 1 that mention comfortable" only decodes and intersects
+a few posting lists and can fetch the matching rows directly.
+
+    index_dir/meta.json         - source file stamp, csv header, categories and counts
+    index_dir/terms.bin         - all of the words (UTF-8) one after the other, sorted
+    index_dir/term_offsets.int64, postings_offsets.int64 - where each word and its
+                                  posting list start (one more entry than words)
+    index_dir/counts.int64      - number of reviews that use each word
+    index_dir/postings.bin      - all of the varint encoded posting lists, in word order
+    index_dir/category.int32, rating.int8, verified.int8, offset.int64 - one entry per review
+Every file is memory-mapped when the index is opened and a word is found by a binary
+search over the sorted words, so opening the index and running a query only touch the
+pages they need however many words and reviews there are.
+
+The index is built with a bounded amount of memory: the posting lists of up to
+run_postings postings are collected at a time and written to disk as a sorted run, and
+the runs are merged word by word at the end. The review numbers only grow, so the
+lists of a word in later runs just continue the lists of the earlier runs.
+'''
+import os
+import io
+import csv
+import json
+import heapq
+import shutil
+import struct
+from array import array
+from itertools import groupby
+import numpy as np #3rd-party
+from scan_engine import review_text
+from tokenizer import tokenize
+
+META_FILE = "meta.json"
+TERMS_FILE = "terms.bin"
+POSTINGS_FILE = "postings.bin"
+RUNS_DIR = "runs"
+ARRAYS = {"category": "int32", "rating": "int8", "verified": "int8", "offset": "int64"}
+TERM_ARRAYS = {"term_offsets": "int64", "postings_offsets": "int64", "counts": "int64"}
+# postings collected in memory before they are written out as a run (4 bytes each)
+RUN_POSTINGS = 8_000_000
+# most postings of one word decoded from the runs and encoded at once when merging
+MERGE_POSTINGS = 1_000_000
+# (word length, number of reviews) before every word of a run file
+RUN_HEADER = struct.Struct("<II")
+
+def encode_postings(ids, start=0):
+    '''
+    Encodes a sorted list of review numbers as varint differences
+    params:
+    ids - sorted array of review numbers
+    start - the review number the first difference is taken from, the last review
+            number of an earlier part of the same list to continue it
+    returns - bytes
+    '''
+    values = np.diff(np.asarray(ids, dtype=np.uint64), prepend=np.uint64(start))
+    sizes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        sizes += values >= np.uint64(1 << (7 * k))
+    out = np.empty(int(sizes.sum()), dtype=np.uint8)
+    starts = np.cumsum(sizes) - sizes
+    for k in range(int(sizes.max(initial=0))):
+        sel = sizes > k
+        byte = (values[sel] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        byte |= np.where(sizes[sel] > k + 1, np.uint64(0x80), np.uint64(0))
+        out[starts[sel] + k] = byte
+    return out.tobytes()
+
+def decode_postings(data):
+    '''
+    Decodes the output of encode_postings
+    params:
+    data - bytes or uint8 array
+    returns - sorted int64 array of review numbers
+    '''
+    data = np.frombuffer(data, dtype=np.uint8) if isinstance(data, bytes) else np.asarray(data, dtype=np.uint8)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7F).astype(np.int64) << (7 * shifts)
+    return np.cumsum(np.add.reduceat(parts, starts))
+
+def _iter_records(f):
+    '''
+    Reads the raw rows of a csv file, a newline only ends a row when it is outside of
+    quotes (an even number of quote characters before it)
+    params:
+    f - the csv file opened in binary mode, positioned at the start of a row
+    yields - (byte offset, raw bytes) of every row
+    '''
+    offset = f.tell()
+    start = offset
+    parts = []
+    quotes = 0
+    for line in f:
+        parts.append(line)
+        quotes += line.count(b'"')
+        offset += len(line)
+        if quotes % 2 == 0:
+            yield start, b"".join(parts)
+            parts = []
+            quotes = 0
+            start = offset
+
+def _parse_rows(records):
+    return csv.reader(io.StringIO(b"".join(records).decode('UTF8'), newline=''))
+
+def _write_run(path, postings):
+    '''
+    Writes the posting lists collected so far as a run file, in word order
+    params:
+    path - the run file
+    postings - dict of word -> array of review numbers
+    '''
+    with open(path, 'wb') as f:
+        for word in sorted(postings):
+            term = word.encode('UTF8')
+            f.write(RUN_HEADER.pack(len(term), len(postings[word])))
+            f.write(term)
+            postings[word].tofile(f)
+
+def _read_run(path):
+    '''
+    yields - (word, uint32 array of review numbers) of a run file, in word order
+    '''
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(RUN_HEADER.size)
+            if not header:
+                return
+            term_length, count = RUN_HEADER.unpack(header)
+            word = f.read(term_length).decode('UTF8')
+            yield word, np.frombuffer(f.read(4 * count), dtype=np.uint32)
+
+def _write_postings(out, parts, start):
+    '''
+    Encodes consecutive parts of a posting list and writes them
+    returns - number of bytes written
+    '''
+    data = encode_postings(parts[0] if len(parts) == 1 else np.concatenate(parts), start)
+    out.write(data)
+    return len(data)
+
+def _tag_run(run, number):
+    # the run number keeps equal words in run order in the merge
+    for word, ids in run:
+        yield word, number, ids
+
+def _path(index_dir, name, dtype):
+    return os.path.join(index_dir, f"{name}.{dtype}")
+
+def build_index(filename, index_dir, batch_size=10000, run_postings=RUN_POSTINGS):
+    '''
+    Builds the inverted index of a parsed csv file
+    params:
+    filename - the parsed csv file from data_parser
+    index_dir - folder to write the index to, created if needed
+    batch_size - number of rows parsed at once
+    run_postings - number of postings collected in memory before they are written out
+                   as a sorted run
+    returns - number of reviews
+    '''
+    assert(isinstance(filename, str) and isinstance(index_dir, str))
+    assert(not filename.endswith(".parquet")), "the index points into the csv file, build it from that"
+    assert(isinstance(run_postings, int) and run_postings > 0)
+    os.makedirs(index_dir, exist_ok=True)
+    runs_dir = os.path.join(index_dir, RUNS_DIR)
+    shutil.rmtree(runs_dir, ignore_errors=True)
+    os.makedirs(runs_dir)
+    runs = []
+    postings = {}
+    held = 0
+    category_ids = {}
+    column_files = {name: open(_path(index_dir, name, dtype) + ".tmp", 'wb') for name, dtype in ARRAYS.items()}
+    try:
+        with open(filename, 'rb') as f:
+            header = next(csv.reader([f.readline().decode('UTF8')]))
+            index = {name: i for i, name in enumerate(header)}
+            review = 0
+            batch = []
+
+            def add_rows(batch, review, held):
+                columns = {"category": array('i'), "rating": array('b'), "verified": array('b'), "offset": array('q')}
+                for (offset, _), row in zip(batch, _parse_rows([record for _, record in batch])):
+                    category = row[index["Source Category"]]
+                    if category not in category_ids:
+                        category_ids[category] = len(category_ids)
+                    columns["category"].append(category_ids[category])
+                    columns["rating"].append(int(float(row[index["Rating"]])))
+                    columns["verified"].append(row[index["Verified"]].lower() == "true")
+                    columns["offset"].append(offset)
+                    words = set(tokenize(review_text(row[index["Review Text"]]), remove_stopwords=False))
+                    for word in words:
+                        ids = postings.get(word)
+                        if ids is None:
+                            ids = postings[word] = array('I')
+                        ids.append(review)
+                    held += len(words)
+                    review += 1
+                for name, values in columns.items():
+                    values.tofile(column_files[name])
+                return review, held
+
+            for record in _iter_records(f):
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    review, held = add_rows(batch, review, held)
+                    batch = []
+                    if held >= run_postings:
+                        runs.append(os.path.join(runs_dir, f"run{len(runs)}.bin"))
+                        _write_run(runs[-1], postings)
+                        postings = {}
+                        held = 0
+            review, held = add_rows(batch, review, held)
+    finally:
+        for column_file in column_files.values():
+            column_file.close()
+
+    # merge the runs, the postings still in memory are the last run
+    sources = [_tag_run(_read_run(path), number) for number, path in enumerate(runs)]
+    sources.append(_tag_run(((word, np.asarray(postings[word], dtype=np.uint32)) for word in sorted(postings)),
+                            len(runs)))
+    term_offsets = array('q', [0])
+    postings_offsets = array('q', [0])
+    counts = array('q')
+    with open(os.path.join(index_dir, TERMS_FILE + ".tmp"), 'wb') as terms_out, \
+            open(os.path.join(index_dir, POSTINGS_FILE + ".tmp"), 'wb') as postings_out:
+        for word, parts in groupby(heapq.merge(*sources), key=lambda entry: entry[0]):
+            last = 0
+            count = 0
+            written = 0
+            pending = []
+            pending_ids = 0
+            for _, _, ids in parts:
+                pending.append(ids)
+                pending_ids += len(ids)
+                # the parts are encoded together, but only up to MERGE_POSTINGS at a time
+                if pending_ids >= MERGE_POSTINGS:
+                    written += _write_postings(postings_out, pending, last)
+                    last = int(ids[-1])
+                    count += pending_ids
+                    pending = []
+                    pending_ids = 0
+            if pending:
+                written += _write_postings(postings_out, pending, last)
+                count += pending_ids
+            term = word.encode('UTF8')
+            terms_out.write(term)
+            term_offsets.append(term_offsets[-1] + len(term))
+            postings_offsets.append(postings_offsets[-1] + written)
+            counts.append(count)
+    shutil.rmtree(runs_dir, ignore_errors=True)
+    for name, values in (("term_offsets", term_offsets), ("postings_offsets", postings_offsets), ("counts", counts)):
+        with open(_path(index_dir, name, TERM_ARRAYS[name]) + ".tmp", 'wb') as f:
+            values.tofile(f)
+    tmp_files = [TERMS_FILE, POSTINGS_FILE] + [f"{name}.{dtype}" for name, dtype in {**ARRAYS, **TERM_ARRAYS}.items()]
+    for name in tmp_files:
+        os.replace(os.path.join(index_dir, name + ".tmp"), os.path.join(index_dir, name))
+    stat = os.stat(filename)
+    meta = {"source": [os.path.abspath(filename), stat.st_size, stat.st_mtime_ns], "header": header,
+            "reviews": review, "categories": list(category_ids), "term_count": len(counts)}
+    with open(os.path.join(index_dir, META_FILE), 'w', encoding='UTF8') as f:
+        json.dump(meta, f)
+    return review
+
+def _map(path, dtype):
+    # np.memmap can not map an empty file
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+class InvertedIndex:
+    '''
+    Queries on a built index
+    params:
+    index_dir - folder written by build_index
+    '''
+    def __init__(self, index_dir):
+        assert(isinstance(index_dir, str))
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, META_FILE), 'r', encoding='UTF8') as f:
+            self.meta = json.load(f)
+        self.categories = self.meta["categories"]
+        for name, dtype in {**ARRAYS, **TERM_ARRAYS}.items():
+            setattr(self, name, _map(_path(index_dir, name, dtype), dtype))
+        self.terms = _map(os.path.join(index_dir, TERMS_FILE), np.uint8)
+        self.postings_data = _map(os.path.join(index_dir, POSTINGS_FILE), np.uint8)
+
+    def __len__(self):
+        return len(self.category)
+
+    def _find(self, term):
+        '''
+        Binary search over the sorted words
+        returns - the number of the word, or None if no review uses it
+        '''
+        key = term.encode('UTF8')
+        offsets = self.term_offsets
+        low, high = 0, len(self.counts)
+        while low < high:
+            middle = (low + high) // 2
+            if self.terms[offsets[middle]:offsets[middle + 1]].tobytes() < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.counts) and self.terms[offsets[low]:offsets[low + 1]].tobytes() == key:
+            return low
+        return None
+
+    def term_count(self, term):
+        '''
+        returns - number of reviews that use the word
+        '''
+        i = self._find(term)
+        return 0 if i is None else int(self.counts[i])
+
+    def postings(self, term):
+        '''
+        params:
+        term - a single word
+        returns - sorted array of the reviews that use the word
+        '''
+        i = self._find(term)
+        if i is None:
+            return np.zeros(0, dtype=np.int64)
+        return decode_postings(self.postings_data[self.postings_offsets[i]:self.postings_offsets[i + 1]])
+
+    def query(self, terms=(), category=None, rating=None, verified=None):
+        '''
+        Finds the reviews that use all of the terms and match the filters
+        params:
+        terms - words (or a string of words) that all have to be used in the review
+        category - the Source Category, or any
+        rating - the rating, or any
+        verified - True/False, or any
+        returns - sorted array of review numbers
+        '''
+        if isinstance(terms, str):
+            terms = [terms]
+        words = sorted({word for term in terms for word in tokenize(term, remove_stopwords=False)},
+                       key=self.term_count)
+        if words:
+            # start with the shortest list, so every intersection is as small as possible
+            ids = self.postings(words[0])
+            for word in words[1:]:
+                if len(ids) == 0:
+                    break
+                ids = np.intersect1d(ids, self.postings(word), assume_unique=True)
+        else:
+            ids = np.arange(len(self), dtype=np.int64)
+        if category is not None:
+            if category not in self.categories:
+                return ids[:0]
+            ids = ids[self.category[ids] == self.categories.index(category)]
+        if rating is not None:
+            ids = ids[self.rating[ids] == int(float(rating))]
+        if verified is not None:
+            ids = ids[self.verified[ids] == int(bool(verified))]
+        return ids
+
+    def count(self, terms=(), category=None, rating=None, verified=None):
+        '''
+        returns - number of reviews that match query()
+        '''
+        return len(self.query(terms, category, rating, verified))
+
+    def counts_by_rating(self, terms=(), category=None):
+        '''
+        returns - dict of rating -> number of reviews that use all of the terms
+        '''
+        ratings = np.bincount(self.rating[self.query(terms, category)], minlength=6)
+        return {rating: int(ratings[rating]) for rating in range(1, 6)}
+
+    def rows(self, ids, filename=None):
+        '''
+        Reads the csv rows of some reviews
+        params:
+        ids - review numbers, e.g. from query()
+        filename - the csv file, the one the index was built from if not given
+        returns - list of rows (lists in the header's column order)
+        '''
+        filename = self.meta["source"][0] if filename is None else filename
+        records = []
+        with open(filename, 'rb') as f:
+            for review in ids:
+                f.seek(int(self.offset[review]))
+                records.append(next(_iter_records(f))[1])
+        return list(_parse_rows(records))
+
+    def close(self):
+        # the memory maps are closed once nothing refers to them
+        for name in [*ARRAYS, *TERM_ARRAYS, "terms", "postings_data"]:
+            setattr(self, name, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def open_index(filename, index_dir):
+    '''
+    Opens the index of a parsed csv file, building it first if it is missing or out of date
+    params:
+    filename - the parsed csv file
+    index_dir - folder of the index
+    returns - InvertedIndex
+    '''
+    assert(isinstance(filename, str) and isinstance(index_dir, str))
+    stat = os.stat(filename)
+    try:
+        index = InvertedIndex(index_dir)
+        if index.meta["source"][1:] == [stat.st_size, stat.st_mtime_ns]:
+            return index
+        index.close()
+    except (OSError, ValueError, KeyError):
+        pass
+    print(f"Building inverted index: {index_dir}")
+    build_index(filename, index_dir)
+    return InvertedIndex(index_dir)
@@ -0,0 +1,85 @@
+'''
+json_backends.py - pluggable json decoding for the data parser
+
+The standard library json module is always available and is the default. orjson,
+ujson and pysimdjson are used when they are installed and asked for, either by name
+or with "auto" which picks the fastest one available.
+
+A projection only returns the fields the parser actually reads. With simdjson the
+line is parsed lazily so the unused fields (long descriptions, image lists, ...)
+are never turned into Python objects, which is what makes it the fastest choice for
+the wide metadata lines. The other backends have to decode the whole line anyway, so
+their projection is just the full decode (copying out the fields only costs time).
+
+benchmarks/bench_json_backends.py prints the rows/second of each installed backend.
+'''
+import importlib
+import json
+
+# fastest first on the review lines, used by "auto"
+BACKENDS = ["orjson", "simdjson", "ujson", "json"]
+
+def _load_module(name):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+def available_backends():
+    '''
+    returns - list of the backend names that can be used here, fastest first
+    '''
+    return [name for name in BACKENDS if name == "json" or _load_module(name) is not None]
+
+def _resolve(backend):
+    if backend is None:
+        return "json"
+    if backend == "auto":
+        return available_backends()[0]
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown json backend '{backend}', expected one of {BACKENDS + ['auto']}")
+    if backend != "json" and _load_module(backend) is None:
+        raise ImportError(f"The '{backend}' json backend is not installed")
+    return backend
+
+def get_decoder(backend=None):
+    '''
+    Gets a function that fully decodes one json line
+    params:
+    backend - backend name, "auto", or None for the standard library
+    returns - function taking a line and returning the decoded object
+    '''
+    backend = _resolve(backend)
+    if backend == "json":
+        return json.loads
+    return _load_module(backend).loads
+
+def make_projector(fields, backend=None):
+    '''
+    Gets a function that decodes only the given top level fields of a json line
+    params:
+    fields - the keys to keep
+    backend - backend name, "auto", or None for the standard library
+    returns - function taking a line and returning a dict with (at least) the fields that are present
+    '''
+    fields = tuple(fields)
+    backend = _resolve(backend)
+    if backend == "simdjson":
+        parser = _load_module("simdjson").Parser()
+
+        def project(line):
+            doc = parser.parse(line)
+            item = {}
+            for field in fields:
+                if field in doc:
+                    value = doc[field]
+                    # arrays and objects come back as lazy proxies tied to the parser
+                    if hasattr(value, "as_list"):
+                        value = value.as_list()
+                    elif hasattr(value, "as_dict"):
+                        value = value.as_dict()
+                    item[field] = value
+            return item
+        return project
+
+    return get_decoder(backend)
@@ -6,85 +6,108 @@ import matplotlib.pyplot as plt #3rd-party
 import seaborn as sns #3rd-party
 import numpy as np #3rd-party
 import os
-import csv
-import json
 from collections import Counter
+from itertools import islice
 from wordcloud import WordCloud
-import string
-from nltk.corpus import stopwords  # Assuming NLTK is installed #3rd-party
-import nltk #3rd-party
+import nltk # Assuming NLTK is installed #3rd-party
+from tokenizer import tokenize, count_words, PhraseCounter
+from cache import cached_scan
+from sketches import KLL
+import corpus_store
+from scan_engine import (VerifiedRatingAggregator, WordFrequencyAggregator, CategoryWordAggregator,
+                         WordUsageAggregator, PriceStatsAggregator, PRICE_BINS, PRICE_LABELS)
 
 # File path and plots saving path
 INPUT_CSV = "truncated_filtered_reviews.csv"
 plots_directory = "temp_plots/"
 
+# Set by render.py to save every chart into the plots directory instead of showing it
+SAVE_PLOTS = False
+
+# Joins reviews that are tokenized together, it stays a word of its own (tokenize keeps "\x00")
+REVIEW_SEPARATOR = " \x00 "
+
+def finish_figure(name, directory=None):
+    '''
+    Shows the finished chart, or saves it as <directory>/<name>.png if SAVE_PLOTS is set,
+    and closes it to start drawing the next one
+    name - file name of the chart without the extension
+    directory - where to save it, plots_directory if not given
+    '''
+    if SAVE_PLOTS:
+        directory = plots_directory if directory is None else directory
+        os.makedirs(directory, exist_ok=True)
+        plt.savefig(os.path.join(directory, name + '.png'))
+    else:
+        plt.show()
+    plt.close('all')
+
+def load_reviews(filename):
+    '''
+    Loads the parsed review data into a DataFrame. Takes either the csv file or the
+    typed Parquet file written by data_parser.process_reviews_folder(columnar_path=...),
+    which loads much faster since the columns do not have to be parsed and typed again
+    input - path to the parsed csv or .parquet file
+    '''
+    assert(isinstance(filename, str))
+    if filename.endswith(".parquet"):
+        return pd.read_parquet(filename)
+    return pd.read_csv(filename, encoding='utf-8')
+
+def iter_review_chunks(filename, columns, chunksize):
+    '''
+    Reads the parsed review data in fixed size chunks, loading only the given columns,
+    so files larger than memory can be processed
+    input - path to the parsed csv or .parquet file
+    columns - the columns to read, the ones the file does not have are skipped
+    chunksize - number of rows per chunk
+    yields - a DataFrame per chunk
+    '''
+    assert(isinstance(filename, str) and isinstance(chunksize, int) and chunksize > 0)
+    if filename.endswith(".parquet"):
+        import pyarrow.parquet as pq #3rd-party
+        parquet = pq.ParquetFile(filename)
+        columns = [column for column in columns if column in parquet.schema_arrow.names]
+        for batch in parquet.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+        return
+    yield from pd.read_csv(filename, encoding='utf-8', usecols=lambda column: column in columns, chunksize=chunksize)
+
 '''
 CONNOR'S TASKS
 ==============================
 '''
-def verified_review_ratings(filename):
+def verified_review_ratings(filename, cache=None):
     '''
     Finds the Ratings and verified reviews
     input - parsed csv file with review data
+    cache - optional cache.AnalysisCache to reuse the result of an earlier run on the same data
     '''
     assert(isinstance(filename,str))
-    with open(filename, 'r', encoding='UTF8') as f:
-        reader = csv.DictReader(f)
-        outputDict = {"verified-ratings": {"1.0": 0,
-                                   "2.0": 0,
-                                   "3.0": 0,
-                                   "4.0": 0,
-                                   "5.0": 0},
-                      "unverified-ratings": {"1.0": 0,
-                                   "2.0": 0,
-                                   "3.0": 0,
-                                   "4.0": 0,
-                                   "5.0": 0}}
-        for line in reader:
-            verified = line["Verified"]
-            if verified.lower() == "true":
-                verified = True
-            else: verified = False
-            if verified:
-                outputDict["verified-ratings"][str(line["Rating"])] += 1
-            else:
-                outputDict["unverified-ratings"][str(line["Rating"])] += 1
-    return outputDict
-
-# Could combine the two for faster run time but keeping separate to make it clear between the prompts
-
-#DOCSTRING
-def word_freq(filename):
+    return cached_scan(filename, {"verified": VerifiedRatingAggregator()}, cache)["verified"]
+
+# Both are aggregators in scan_engine.py, connor_main and report_main run them in a single pass
+
+def word_freq(filename, jobs=1, cache=None, corpus_dir=None, capacity=None):
     '''
     Finds the counts of each word in the review text
     input - the parsed csv file
+    jobs - number of processes counting parts of the file (see scan_engine.scan)
+    cache - optional cache.AnalysisCache to reuse the result of an earlier run on the same data
+    corpus_dir - optional folder of the token id corpus (see corpus_store.py, built on first
+                 use), the words are then counted from the token ids without reading the text.
+                 jobs, cache and capacity do not apply to it and can not be combined with it
+    capacity - if given, count approximately in fixed memory with this many counters (see
+               sketches.py), for data with too many distinct words to count exactly
     '''
     assert(isinstance(filename, str))
-    with open(filename, 'r', encoding="UTF8") as f:
-        symbols = "!@#$%^&*()_+-=[]\\{}|,./<>?:\";\'"
-        reader = csv.DictReader(f)
-        outputDict = {}
-        stopwords = set(nltk.corpus.stopwords.words('english'))
-        for line in reader:
-            words = line["Review Text"].split()
-            for word in words:
-                word = word.lower()
-                for char in symbols:
-                    #remove symbols to just filter out people that don't use symbols and punctuation
-                    word = word.replace(char, "")
-                if word in stopwords or word == '':
-                    continue
-                try:
-                    outputDict[word] += 1
-                except KeyError:
-                    outputDict[word] = 1
-    counts = Counter(outputDict).most_common(100)
-    outputDict = {}
-    for count in counts:
-        outputDict[count[0]] = count[1]
-    return outputDict
-
-def make_wordcloud(input_dict):
+    if corpus_dir is not None:
+        assert(jobs == 1 and cache is None and capacity is None), "jobs, cache and capacity do not apply with corpus_dir"
+        return corpus_store.word_freq(corpus_store.open_corpus(filename, corpus_dir), 100)
+    return cached_scan(filename, {"words": WordFrequencyAggregator(100, capacity)}, cache, jobs=jobs)["words"]
+
+def make_wordcloud(input_dict, plots_dir=None):
+    # plots_dir - where the chart is saved, plots_directory if not given
     assert(isinstance(input_dict, dict))
     wc = WordCloud(background_color="white", max_words=1000)
     wc.generate_from_frequencies(input_dict)
@@ -92,12 +115,11 @@ def make_wordcloud(input_dict):
     # display graph
     plt.imshow(wc, interpolation="bilinear")
     plt.axis("off")
-    #plt.savefig(os.path.join(plots_directory, 'all_cats_wordcloud.png'))
-    plt.show()
-    #plt.close()
+    finish_figure('all_cats_wordcloud', plots_dir)
 
 #Reference Source https://www.geeksforgeeks.org/plotting-multiple-bar-charts-using-matplotlib-in-python/
-def make_verfied_charts(input_dict):
+def make_verfied_charts(input_dict, plots_dir=None):
+    # plots_dir - where the charts are saved, plots_directory if not given
     X = ["1.0", "2.0", "3.0", "4.0", "5.0"]
     X2 = ["Verified", "Unverified"]
     YVerified = []
@@ -114,9 +136,7 @@ def make_verfied_charts(input_dict):
     fig, (ax3) = plt.subplots(1,1)
     ax3.pie(YCounts, labels=X2, autopct='%1.1f%%')
     fig.suptitle("Proportion of Verified Reviews")
-    #plt.savefig(os.path.join(plots_directory, 'verified_proportions.png'))
-    plt.show()
-    #plt.close()
+    finish_figure('verified_proportions', plots_dir)
 
     fig, (ax1, ax2) = plt.subplots(1,2)
     fig.suptitle("Counts by Verified Status")
@@ -124,9 +144,7 @@ def make_verfied_charts(input_dict):
     ax1.set_title("Verified Reviews")
     ax2.pie(YUnverified, labels=X, autopct='%1.1f%%')
     ax2.set_title("Unverified Reviews")
-    #plt.savefig(os.path.join(plots_directory, 'verified_ratings.png'))
-    plt.show()
-    #plt.close()
+    finish_figure('verified_ratings', plots_dir)
 
 '''
 ZEYU'S & LINXIAO'S TASKS
@@ -148,9 +166,7 @@ def plot_average_rating_by_price_category(data, plots_directory):
     plt.ylabel('Average Rating')
     plt.legend(title='Source Category', bbox_to_anchor=(1.05, 1), loc='upper left')
     plt.tight_layout()
-    #plt.savefig(os.path.join(plots_directory, 'average_rating_by_price_category.png'))
-    plt.show()
-    plt.close()
+    finish_figure('average_rating_by_price_category', plots_directory)
 
 def handle_price(price):
     """
@@ -180,7 +196,65 @@ def handle_price(price):
     except (ValueError, TypeError):
         return pd.NA
 
-def plot_avg_and_median_prices_by_rating_for_category(category_data, plots_directory, category_name):
+def _to_float_or_nan(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+def parse_prices(prices):
+    """
+    Vectorized version of handle_price for a whole column of prices.
+
+    Removes '$' and spaces, treats en dashes like '-' and splits ranges on '-'. A value
+    is only parsed if every part of it is a number, like handle_price does. Every review
+    of a product has the same price string, so only the distinct strings are parsed.
+
+    Parameters:
+    prices (pandas.Series): The price values to convert.
+
+    Returns:
+    pandas.DataFrame: 'low' and 'high' (the smallest and largest part of a range, both
+    equal to the price for a single price) and 'mid' (the average of the parts, which is
+    what handle_price returns). Prices that can not be converted are NaN.
+    """
+    codes, uniques = pd.factorize(prices)
+    cleaned = pd.Series(uniques, dtype=object).astype(str)
+    cleaned = cleaned.str.replace('$', '', regex=False).str.replace(' ', '', regex=False)
+    cleaned = cleaned.str.replace('–', '-', regex=False)
+    parsed = np.full((len(cleaned), 3), np.nan)
+
+    # single prices
+    is_range = cleaned.str.contains('-', regex=False).to_numpy()
+    single = _parse_numbers(cleaned[~is_range])
+    parsed[~is_range] = single.to_numpy()[:, None]
+
+    # ranges, valid only if every part is a number
+    if is_range.any():
+        parts = cleaned[is_range].str.split('-', expand=True, regex=False)
+        numbers = parts.apply(_parse_numbers)
+        valid = (numbers.notna().sum(axis=1) == parts.notna().sum(axis=1)).to_numpy()
+        ranges = np.column_stack([numbers.min(axis=1), numbers.max(axis=1), numbers.mean(axis=1)])
+        ranges[~valid] = np.nan
+        parsed[is_range] = ranges
+
+    # code -1 marks missing values
+    result = parsed[codes]
+    result[codes == -1] = np.nan
+    return pd.DataFrame(result, columns=['low', 'high', 'mid'], index=prices.index)
+
+def _parse_numbers(strings):
+    """
+    pd.to_numeric that also takes what float() takes but to_numeric does not (underscores
+    and non-ascii digits). None stays NaN.
+    """
+    numbers = pd.to_numeric(strings, errors='coerce').astype(float)
+    retry = numbers.isna() & strings.notna()
+    if retry.any():
+        numbers[retry] = strings[retry].map(_to_float_or_nan)
+    return numbers
+
+def plot_avg_and_median_prices_by_rating_for_category(category_data, plots_directory, category_name, price_stats=None):
     """
     Create and save a plot showing the average and median prices by rating for a given category.
 
@@ -188,9 +262,12 @@ def plot_avg_and_median_prices_by_rating_for_category(category_data, plots_direc
     category_data (pandas.DataFrame): The data for the specific category.
     plots_directory (str): The directory where the plot will be saved.
     category_name (str): The name of the category being processed.
+    price_stats (pandas.DataFrame, optional): Already computed 'Rating', 'mean' and 'median'
+        columns, in which case category_data is not used.
     """
     # First, calculate the average and median prices for each rating level
-    price_stats = category_data.groupby('Rating')['Price Lower Bound'].agg(['mean', 'median']).reset_index()
+    if price_stats is None:
+        price_stats = category_data.groupby('Rating')['Price Lower Bound'].agg(['mean', 'median']).reset_index()
 
     # Set the figure size
     plt.figure(figsize=(10, 6))
@@ -204,29 +281,26 @@ def plot_avg_and_median_prices_by_rating_for_category(category_data, plots_direc
     # Add legend
     plt.legend()
 
-    # Save the chart
-    #plt.savefig(os.path.join(plots_directory, f'avg_median_prices_{category_name}.png'))
+    # Save the chart and close it to start drawing the next one
+    finish_figure(f'avg_median_prices_{category_name}', plots_directory)
 
-    # Close the plot to start drawing the next one
-    plt.show()
-    plt.close()
-
-def plot_overall_rating_distribution(data, plots_directory):
+def plot_overall_rating_distribution(data, plots_directory, ratings_counts=None):
     """
     Create and save a pie chart for the overall rating distribution.
 
     Parameters:
     data (pandas.DataFrame): The dataset.
     plots_directory (str): The directory where the plot will be saved.
+    ratings_counts (pandas.Series, optional): Already computed number of reviews per
+        rating, in which case data is not used.
     """
-    ratings_counts = data['Rating'].value_counts()
+    if ratings_counts is None:
+        ratings_counts = data['Rating'].value_counts()
     plt.figure(figsize=(8, 8))
     plt.pie(ratings_counts, labels=ratings_counts.index, autopct='%1.1f%%', startangle=140)
     plt.title('Overall Ratings Distribution')
     plt.tight_layout()
-    #plt.savefig(os.path.join(plots_directory, 'overall_ratings_distribution_pie.png'))
-    plt.show()
-    plt.close()
+    finish_figure('overall_ratings_distribution_pie', plots_directory)
 
 '''
 SAHIL'S TASKS
@@ -236,24 +310,18 @@ def preprocess_text(text):
   """
   Preprocesses text for better word analysis.
 
+  Meant for one review at a time; to count the words of many reviews use
+  tokenizer.count_words (or word_counts_by_category_and_rating) on an iterable of the
+  reviews, which counts them incrementally into a Counter instead of joining them.
+
   Args:
       text: A string containing text to be preprocessed.
 
   Returns:
       A string containing the preprocessed text.
   """
-  if len(text)>10000000:
-      text = text[:10000000]
-  # Lowercase all characters
-  text = text.lower()
-
-  # Remove punctuation (consider using a regular expression for more flexibility)
-  punc = set(string.punctuation)
-  text = "".join([char for char in text if char not in punc])
-
-  # Remove stopwords (using NLTK)
-  stop_words = set(stopwords.words('english'))
-  text = " ".join([word for word in text.split() if word not in stop_words])
+  # Lowercase, remove punctuation and stopwords (using NLTK), see tokenizer.py
+  text = " ".join(tokenize(text))
 
   # Additional preprocessing steps (optional):
   # - Stemming or lemmatization (reduce words to their base forms)
@@ -261,242 +329,409 @@ def preprocess_text(text):
 
   return text
 
-def visualize_top_words(df, n_words=5):
+def word_counts_by_category_and_rating(df):
+    """
+    Counts the words of the reviews of every category and rating in a single grouped pass
+    (instead of filtering the whole DataFrame for each category and rating).
+
+    Args:
+        df: A pandas DataFrame with 'Source Category', 'Rating' and 'Review Text' columns.
+
+    Returns:
+        A dict of (category, rating) -> Counter of the preprocessed words.
+    """
+    grouped = df.groupby(['Source Category', 'Rating'], sort=False, observed=True)['Review Text']
+    return {key: count_words(texts) for key, texts in grouped}
+
+def visualize_top_words(df=None, n_words=5, per_rating=False, plots_dir=None):
     """
     Creates bar charts and word counts showing the top n most common words for each category and also per rating.
 
     Args:
-        df: A pandas DataFrame containing columns like 'category' and 'review_text'.
+        df: A pandas DataFrame containing columns like 'category' and 'review_text'. INPUT_CSV is loaded if not given.
         n_words: The number of most common words to display (default: 5).
+        per_rating: Also make a wordcloud and bar chart for every rating of every category (default: False,
+            since they were not used in the presentation).
+        plots_dir: Where the charts are saved, plots_directory if not given.
     """
-    filename = INPUT_CSV
-    df = pd.read_csv(filename, encoding='utf-8')
-    df['Review Text'] = df['Review Text'].astype(str)
-    categories = df['Source Category'].unique()
+    if df is None:
+        df = load_reviews(INPUT_CSV)
+    df['Review Text'] = df['Review Text'].fillna('').astype(str)
+    cell_counts = word_counts_by_category_and_rating(df)
+
+    # The counts of a category are the sum of the counts of its ratings
+    category_counts = {}
+    for (category, rating), word_counts in cell_counts.items():
+        category_counts.setdefault(category, Counter()).update(word_counts)
 
-    ratings = list(range(1,6))
-    for category in categories:
+    for category, word_counts in category_counts.items():
         print(f'Starting with {category} category')
-        filtered_by_category = df[df['Source Category'] == category]
-        if not len(filtered_by_category):
-                continue
-        # Combine all review text for this category into a single string
-        all_text = " ".join(filtered_by_category['Review Text'])
-
-        # Preprocess text (optional): lowercase, remove stopwords, punctuation
-        # (consider using NLTK for advanced text processing)
-        all_text = preprocess_text(all_text)
-
-        # Create a WordCloud object
-        #wordcloud = WordCloud(width=800, height=600).generate(all_text)
-
-        # Create a Counter object to count word frequencies
-        word_counts = Counter(all_text.split())
-
-        # Get the top n most common words
-        top_n_words = word_counts.most_common(n_words)
-
-        # Extract words and counts for the bar chart
-        words, counts = zip(*top_n_words)
-
-        # Create a new figure for the wordcloud
-        #plt.figure()
-        #plt.imshow(wordcloud, interpolation='bilinear')
-        #plt.axis('off')
-        #plt.title(f"Most Common Words in Reviews (Category: {category})")
-        #plt.show()
-        #plt.savefig(f"{category[:-5]}")
-        #plt.close()
-
-        # Create a new figure for the bar chart
-        plt.figure()
-        plt.bar(words, counts)
-        plt.xlabel("Word")
-        plt.ylabel("Frequency")
-        plt.title(f"Top {n_words} Words in Reviews (Category: {category})")
-        plt.xticks(rotation=45, ha="right")  # Rotate x-axis labels for better readability
-        plt.tight_layout()
-        plt.show()
-        #plt.savefig(f"{category[:-5]} bar chart")
-        plt.close()
-        ''' REMOVING THE RATINGS SINCE NOT USED IN THE PRESENTATION
-        for rating in ratings:
+        plot_top_words(category, word_counts, n_words, plots_dir=plots_dir)
+        if not per_rating:
+            continue
+        for rating in sorted(rating for (cell_category, rating) in cell_counts if cell_category == category):
             print(f'Starting with {rating} rating products for {category} category')
-            filtered_df = filtered_by_category[filtered_by_category['Rating'] == rating]
-            if not len(filtered_df):
+            word_counts = cell_counts[(category, rating)]
+            if not word_counts:
                 continue
-            # Combine all review text for this category into a single string
-            all_text = " ".join(filtered_df['Review Text'])
-
-            # Preprocess text (optional): lowercase, remove stopwords, punctuation
-            # (consider using NLTK for advanced text processing)
-            all_text = preprocess_text(all_text)
-
-            # Create a WordCloud object
-            wordcloud = WordCloud(width=800, height=600).generate(all_text)
-
-            # Create a Counter object to count word frequencies
-            word_counts = Counter(all_text.split())
-
-            # Get the top n most common words
-            top_n_words = word_counts.most_common(n_words)
-
-            # Extract words and counts for the bar chart
-            words, counts = zip(*top_n_words)
 
             # Create a new figure for the wordcloud
+            wordcloud = WordCloud(width=800, height=600).generate_from_frequencies(word_counts)
             plt.figure()
             plt.imshow(wordcloud, interpolation='bilinear')
             plt.axis('off')
-            plt.title(f"Most Common Words in Reviews (Category: {category})")
-            plt.show()
-            #plt.savefig(f"{category[:-5]} {rating}")
-            plt.close()
+            plt.title(f"Most Common Words in Reviews (Category: {category}, Rating: {rating})")
+            finish_figure(f"{category[:-5]} {rating}", plots_dir)
 
-            # Create a new figure for the bar chart
-            plt.figure()
-            plt.bar(words, counts)
-            plt.xlabel("Word")
-            plt.ylabel("Frequency")
-            plt.title(f"Top {n_words} Words in Reviews (Category: {category})")
-            plt.xticks(rotation=45, ha="right")  # Rotate x-axis labels for better readability
-            plt.tight_layout()
-            plt.show()
-            #plt.savefig(f"{category[:-5]} {rating} bar chart")
-            plt.close()'''
-
-def count_word_occurrences(text, word):
+            plot_top_words(category, word_counts, n_words, rating, plots_dir)
+
+def plot_top_words(category, word_counts, n_words=5, rating=None, plots_dir=None):
+    """
+    Creates the bar chart of the top n most common words of a category.
+
+    Args:
+        category: The name of the category.
+        word_counts: A Counter of the words used in the category's reviews.
+        n_words: The number of most common words to display (default: 5).
+        rating: The rating the counts are limited to, if any.
+        plots_dir: Where the chart is saved, plots_directory if not given.
+    """
+    # Get the top n most common words
+    top_n_words = word_counts.most_common(n_words)
+    if not top_n_words:
+        return
+
+    # Extract words and counts for the bar chart
+    words, counts = zip(*top_n_words)
+
+    # Create a new figure for the bar chart
+    plt.figure()
+    plt.bar(words, counts)
+    plt.xlabel("Word")
+    plt.ylabel("Frequency")
+    if rating is None:
+        plt.title(f"Top {n_words} Words in Reviews (Category: {category})")
+    else:
+        plt.title(f"Top {n_words} Words in Reviews (Category: {category}, Rating: {rating})")
+    plt.xticks(rotation=45, ha="right")  # Rotate x-axis labels for better readability
+    plt.tight_layout()
+    if rating is None:
+        finish_figure(f"{category[:-5]} bar chart", plots_dir)
+    else:
+        finish_figure(f"{category[:-5]} {rating} bar chart", plots_dir)
+
+def count_word_occurrences(text, word, batch_size=10000):
   """
   Counts the frequency of the word "good" and the phrase "not good" in a string.
 
   Args:
-      text: The string to analyze.
+      text: The string to analyze, or an iterable of review strings which are tokenized
+          batch_size reviews at a time (like tokenizer.count_words) so any number of reviews fits in memory.
+      word: The word to count ("good").
+      batch_size: The number of reviews tokenized at once.
 
   Returns:
-      A dictionary containing counts for "good", "not good", and the total number of words.
+      A Counter containing counts for "good", "not good", and the total number of words.
+      Counters of different parts of the data can be added together.
   """
-  if len(text)>10000000:
-      text = text[:10000000]
-  word_counts = {"good": 0, "not good": 0, "total_words": 0}
-  text = text.lower()  # Convert to lowercase for case-insensitive counting
-
-  # Split the text into words
-  words = text.split()
-  word_counts["total_words"] = len(words)
-
-  # Count occurrences of "good" and "not good"
-  for i in range(len(words)):
-    if (words[i] == "not" and i + 1 < len(words) and words[i + 1] == word): #or words[i] == "bad":  # Check for "not good" phrase
-      word_counts["not good"] += 1
-    elif words[i] == word:
-      word_counts["good"] += 1
+  word_counts = Counter({"good": 0, "not good": 0, "total_words": 0})
+  reviews = iter([text] if isinstance(text, str) else text)
+
+  while True:
+    batch = list(islice(reviews, batch_size))
+    if not batch:
+      break
+    # Split the text into lowercase words, keeping the stopwords since "not" is one. The reviews are
+    # joined with a word of their own so a review ending in "not" does not negate the next one
+    words = tokenize(REVIEW_SEPARATOR.join(batch), remove_stopwords=False)
+    word_counts["total_words"] += len(words) - (len(batch) - 1)
+
+    # Count occurrences of "good" and "not good" in one pass over the words
+    positions = [i for i, current in enumerate(words) if current == word]
+    word_counts["good"] += len(positions)
+    word_counts["not good"] += sum(1 for i in positions if i > 0 and words[i - 1] == "not")
 
   return word_counts
 
-def visualize_word_usage_over_ratings(df, word):
+def phrase_counts_by_category_and_rating(df, terms, negations=True):
     """
-    Counts
+    Counts a list of words and phrases (and their "not" forms) in the reviews of every
+    category and rating, all of them in one pass over the words of each review.
+
+    Args:
+        df: A pandas DataFrame with 'Source Category', 'Rating' and 'Review Text' columns.
+        terms: The words and phrases to count, like ['good', 'comfortable', 'highly recommend'].
+        negations: Also count "not <term>" for every term (default: True).
+
+    Returns:
+        A dict of (category, rating) -> dict of term -> count.
     """
-    filename = INPUT_CSV
-    df = pd.read_csv(filename, encoding='utf-8')
-    df['Review Text'] = df['Review Text'].astype(str)
-    categories = df['Source Category'].unique()
-
-    ratings = list(range(1,6))
-    for category in categories:
-        good_count = {}
-        not_good_count = {}
-        if word == "comfortable" and "AMAZON_FASHION" not in category:
-            continue
-        #print(f'Starting with {category} category')
-        filtered_by_category = df[df['Source Category'] == category]
-        if not len(filtered_by_category):
-                continue
-        for rating in ratings:
-            #print(f'Starting with {rating} rating products for {category} category')
-            filtered_df = filtered_by_category[filtered_by_category['Rating'] == rating]
-            if not len(filtered_df):
+    counter = PhraseCounter(terms, negations)
+    grouped = df.groupby(['Source Category', 'Rating'], sort=False, observed=True)['Review Text']
+    return {key: counter.by_term(counter.count_texts(texts)) for key, texts in grouped}
+
+def visualize_word_usage_over_ratings(df, words, plots_dir=None):
+    """
+    Counts how often words are used in the reviews of every rating of each category, in a
+    single grouped pass for all of the words, and plots them.
+
+    Args:
+        df: A pandas DataFrame with 'Source Category', 'Rating' and 'Review Text' columns. INPUT_CSV is loaded if None.
+        words: The word (or list of words and phrases) to count.
+        plots_dir: Where the charts are saved, plots_directory if not given.
+    """
+    if df is None:
+        df = load_reviews(INPUT_CSV)
+    df['Review Text'] = df['Review Text'].fillna('').astype(str)
+    words = [words] if isinstance(words, str) else list(words)
+
+    good_counts = {word: {} for word in words}
+    not_good_counts = {word: {} for word in words}
+    for (category, rating), count in phrase_counts_by_category_and_rating(df, words).items():
+        for word in words:
+            if word == "comfortable" and "AMAZON_FASHION" not in category:
                 continue
-            # Combine all review text for this category into a single string
-            all_text = " ".join(filtered_df['Review Text'])
-            count = count_word_occurrences(all_text, word)
-            good_count[rating] = count['good']
-            not_good_count[rating] = count['not good']
-        
-        good_count = sorted((float(x),y) for x, y in good_count.items())
-        x_vals = [x for x, _ in good_count]
-        y_vals = [y for _, y in good_count]
-
-        # Create the line graph
-        plt.plot(x_vals, y_vals, color='blue', linestyle='-')
-        # plt.plot(list(not_good_count.keys()), list(not_good_count.values()), color='red', linestyle='-')
-
-        # Add labels and title
-        plt.xlabel('Ratings')
-        plt.ylabel('Frequency of occurence of the words')
-        plt.title(f'Line Graph For Usage of {word} in {category[:-5]}')
-
-        # Add grid lines
-        plt.grid(True)
+            good_counts[word].setdefault(category, {})[rating] = count[word]
+            not_good_counts[word].setdefault(category, {})[rating] = count['not ' + word]
 
-        plt.show()
-        #plt.savefig(f"{category[:-5]} line chart")
-        plt.close()
+    for word in words:
+        for category, good_count in good_counts[word].items():
+            plot_word_usage(category, word, good_count, plots_dir)
+
+def plot_word_usage(category, word, good_count, plots_dir=None):
+    """
+    Creates the line graph of how often a word is used in the reviews of each rating.
+
+    Args:
+        category: The name of the category.
+        word: The word that was counted.
+        good_count: A dict of rating -> number of times the word was used.
+        plots_dir: Where the chart is saved, plots_directory if not given.
+    """
+    good_count = sorted((float(x),y) for x, y in good_count.items())
+    x_vals = [x for x, _ in good_count]
+    y_vals = [y for _, y in good_count]
+
+    # Create the line graph
+    plt.plot(x_vals, y_vals, color='blue', linestyle='-')
+    # plt.plot(list(not_good_count.keys()), list(not_good_count.values()), color='red', linestyle='-')
+
+    # Add labels and title
+    plt.xlabel('Ratings')
+    plt.ylabel('Frequency of occurence of the words')
+    plt.title(f'Line Graph For Usage of {word} in {category[:-5]}')
+
+    # Add grid lines
+    plt.grid(True)
+
+    finish_figure(f"{category[:-5]} {word} line chart", plots_dir)
 
 '''
 MAIN FUNCTIONS
 '''
 
-def zeyu_linxiao_main():
-    # ZEYU LINXIAO PROCESSING
-    # Load data and assert necessary columns
-    data = pd.read_csv(INPUT_CSV)
-    assert 'Rating' in data.columns, "Column 'Rating' is missing from the DataFrame."
-    assert 'Source Category' in data.columns, "Column 'Source Category' is missing from the DataFrame."
+# Categories that get the average and median price by rating charts
+PRICE_CHART_CATEGORIES = ["Office_Products_5.json","Toys_and_Games_5.json"]
 
+def add_price_columns(data):
+    """
+    Adds the 'Price', 'Price Lower Bound' and 'Price Category' columns.
+
+    Parameters:
+    data (pandas.DataFrame): Data with a 'Product Price' column (or an already parsed 'Price').
+    """
+    # Process prices and create price categories (the Parquet file already has them parsed)
+    if 'Price' not in data.columns:
+        data['Price'] = parse_prices(data['Product Price'])['mid']
+    data['Price Lower Bound'] = data['Price'].fillna(0)
+    # the same price categories as the scan and chunked paths (scan_engine.price_category)
+    data['Price Category'] = pd.cut(data['Price Lower Bound'], bins=PRICE_BINS, labels=PRICE_LABELS, right=False)
+
+def chunked_price_aggregates(filename, chunksize, categories=PRICE_CHART_CATEGORIES):
+    """
+    Computes everything zeyu_linxiao_main plots while reading the data in chunks, so the
+    whole file never has to fit in memory. Only the rating, category and price columns
+    are read.
+
+    Parameters:
+    filename (str): The parsed csv or .parquet file.
+    chunksize (int): Number of rows per chunk.
+    categories (list): Categories to collect the prices by rating of.
+
+    Returns:
+    tuple: (average rating per source and price category as a DataFrame,
+            number of reviews per rating as a Series,
+            dict of category -> DataFrame of the 'Rating', 'mean' and 'median' price)
+    """
+    rating_sums = None
+    ratings_counts = None
+    # the medians come from a quantile sketch per category and rating (see sketches.py),
+    # so the prices do not have to be kept
+    prices = {}
+    columns = ['Source Category', 'Rating', 'Product Price', 'Price']
+    for chunk in iter_review_chunks(filename, columns, chunksize):
+        add_price_columns(chunk)
+        sums = chunk.groupby(['Source Category', 'Price Category'], observed=True)['Rating'].agg(['sum', 'count'])
+        rating_sums = sums if rating_sums is None else rating_sums.add(sums, fill_value=0)
+        counts = chunk['Rating'].value_counts()
+        ratings_counts = counts if ratings_counts is None else ratings_counts.add(counts, fill_value=0)
+        chunk = chunk[chunk['Source Category'].isin(categories)]
+        for (category, rating), group in chunk.groupby(['Source Category', 'Rating'])['Price Lower Bound']:
+            prices.setdefault(category, {}).setdefault(rating, KLL()).update_many(group.to_numpy())
+
+    by_price_category = (rating_sums['sum'] / rating_sums['count']).rename('Rating').reset_index()
+    by_price_category['Price Category'] = pd.Categorical(by_price_category['Price Category'], categories=PRICE_LABELS)
+    price_stats = {}
+    for category, by_rating in prices.items():
+        rows = []
+        for rating in sorted(by_rating):
+            rows.append((rating, by_rating[rating].mean(), by_rating[rating].median()))
+        price_stats[category] = pd.DataFrame(rows, columns=['Rating', 'mean', 'median'])
+    return by_price_category, ratings_counts.sort_values(ascending=False).astype(int), price_stats
+
+def zeyu_linxiao_main(chunksize=None, filename=None, plots_dir=None):
+    '''
+    chunksize - if given, the data is read this many rows at a time (see chunked_price_aggregates)
+                so the full untruncated dataset can be used
+    filename - the parsed csv or .parquet file, INPUT_CSV if not given
+    plots_dir - where the charts go, plots_directory if not given
+    '''
+    filename = INPUT_CSV if filename is None else filename
+    plots_dir = plots_directory if plots_dir is None else plots_dir
+    # ZEYU LINXIAO PROCESSING
     # Set chart aesthetics
     sns.set(style="whitegrid")
 
     # Create directory for saving charts
-    if not os.path.exists(plots_directory):
-        os.makedirs(plots_directory)
+    if not os.path.exists(plots_dir):
+        os.makedirs(plots_dir)
+
+    if chunksize is not None:
+        by_price_category, ratings_counts, price_stats = chunked_price_aggregates(filename, chunksize)
+        plot_average_rating_by_price_category(by_price_category, plots_dir)
+        plot_overall_rating_distribution(None, plots_dir, ratings_counts)
+        for category in PRICE_CHART_CATEGORIES:
+            if category in price_stats:
+                plot_avg_and_median_prices_by_rating_for_category(None, plots_dir, category, price_stats[category])
+        return
 
-    # Process prices and create price categories
-    data['Price'] = data['Product Price'].astype(str).apply(handle_price)
-    data['Price Lower Bound'] = data['Price'].fillna(0)
-    bins = [0, 10, 20, 30, 40, 50, 100, 200, 500]
-    labels = ['0-10', '10-20', '20-30', '30-40', '40-50', '50-100', '100-200', '200-500']
-    data['Price Category'] = pd.cut(data['Price Lower Bound'], bins=bins, labels=labels, right=False)
+    # Load data and assert necessary columns
+    data = load_reviews(filename)
+    assert 'Rating' in data.columns, "Column 'Rating' is missing from the DataFrame."
+    assert 'Source Category' in data.columns, "Column 'Source Category' is missing from the DataFrame."
+
+    add_price_columns(data)
 
     # Perform visualization tasks
     source_categories = data['Source Category'].unique()
-    plot_average_rating_by_price_category(data, plots_directory)
-    plot_overall_rating_distribution(data, plots_directory)
+    plot_average_rating_by_price_category(data, plots_dir)
+    plot_overall_rating_distribution(data, plots_dir)
 
     # Plot charts for average and median prices by rating for each category
     for category in source_categories:
-        if category not in ["Office_Products_5.json","Toys_and_Games_5.json"]:continue
+        if category not in PRICE_CHART_CATEGORIES:continue
         category_data = data[data['Source Category'] == category]
         if not category_data.empty:
-            plot_avg_and_median_prices_by_rating_for_category(category_data, plots_directory, category)
+            plot_avg_and_median_prices_by_rating_for_category(category_data, plots_dir, category)
+
+def connor_main(jobs=1, filename=None, cache=None, plots_dir=None):
+    filename = INPUT_CSV if filename is None else filename
+    nltk.download('stopwords')
+    results = cached_scan(filename, {"verified": VerifiedRatingAggregator(), "words": WordFrequencyAggregator(100)},
+                          cache, jobs=jobs)
+    output = results["verified"]
+    output["Word Frequencies"] = results["words"]
+    make_verfied_charts(output, plots_dir)
+    make_wordcloud(output["Word Frequencies"], plots_dir)
+
+def sahil_main(filename=None, plots_dir=None):
+    filename = INPUT_CSV if filename is None else filename
+    df = load_reviews(filename)
+    df['Review Text'] = df['Review Text'].fillna('').astype(str)
+    visualize_top_words(df.copy(), plots_dir=plots_dir)
+    visualize_word_usage_over_ratings(df, ['good', 'comfortable'], plots_dir)
+
+def report_aggregators():
+    '''
+    returns - the scan_engine aggregators of every chart of the report, by name
+    '''
+    return {"verified": VerifiedRatingAggregator(),
+            "words": WordFrequencyAggregator(100),
+            "category words": CategoryWordAggregator(),
+            "word usage": WordUsageAggregator(['good', 'comfortable']),
+            "prices": PriceStatsAggregator()}
+
+def report_figures(results, plots_dir, charts="all"):
+    '''
+    Lists the charts of the report. Every chart only needs its own (small) part of the
+    aggregates, so they can be drawn in any order or in different processes (render.py)
+    results - the scan results of report_aggregators()
+    plots_dir - where the charts go
+    charts - "all", or only the charts of "connor", "zeyu" or "sahil"
+    returns - list of (plot function, arguments)
+    '''
+    figures = []
+
+    # CONNOR
+    if charts in ("all", "connor"):
+        figures.append((make_verfied_charts, (results["verified"], plots_dir)))
+        figures.append((make_wordcloud, (results["words"], plots_dir)))
+
+    # ZEYU LINXIAO
+    if charts in ("all", "zeyu"):
+        prices = results["prices"]
+        by_price_category = pd.DataFrame([(category, label, total / count) for (category, label), (total, count)
+                                          in prices["rating by price category"].items()],
+                                         columns=['Source Category', 'Price Category', 'Rating'])
+        by_price_category['Price Category'] = pd.Categorical(by_price_category['Price Category'], categories=PRICE_LABELS)
+        figures.append((plot_average_rating_by_price_category, (by_price_category, plots_dir)))
+        ratings_counts = pd.Series({float(rating): count for rating, count in prices["rating counts"].items()},
+                                   name='count').sort_values(ascending=False)
+        figures.append((plot_overall_rating_distribution, (None, plots_dir, ratings_counts)))
+        for category in PRICE_CHART_CATEGORIES:
+            price_stats = pd.DataFrame([(float(rating), sketch.mean(), sketch.median())
+                                        for (cat, rating), sketch in sorted(prices["prices by rating"].items())
+                                        if cat == category], columns=['Rating', 'mean', 'median'])
+            if not price_stats.empty:
+                figures.append((plot_avg_and_median_prices_by_rating_for_category, (None, plots_dir, category, price_stats)))
+
+    # SAHIL
+    if charts in ("all", "sahil"):
+        category_words = {}
+        for (category, rating), counts in results["category words"].items():
+            category_words.setdefault(category, Counter()).update(counts)
+        for category, counts in category_words.items():
+            figures.append((plot_top_words, (category, counts, 5, None, plots_dir)))
+        for word, cells in results["word usage"].items():
+            by_category = {}
+            for (category, rating), count in cells.items():
+                by_category.setdefault(category, {})[float(rating)] = count['good']
+            for category, good_count in by_category.items():
+                if word == "comfortable" and "AMAZON_FASHION" not in category:
+                    continue
+                figures.append((plot_word_usage, (category, word, good_count, plots_dir)))
+    return figures
 
-def connor_main():
-    output = verified_review_ratings(INPUT_CSV)
+def report_main(jobs=1, filename=None, plots_dir=None, cache=None):
+    '''
+    Makes all of the charts of the three mains above from a single pass over the data
+    jobs - number of processes scanning the data
+    filename - the parsed csv or .parquet file, INPUT_CSV if not given
+    plots_dir - where the charts go, plots_directory if not given
+    cache - optional cache.AnalysisCache, with it only the charts are redrawn when the data did not change
+    '''
+    filename = INPUT_CSV if filename is None else filename
+    plots_dir = plots_directory if plots_dir is None else plots_dir
     nltk.download('stopwords')
-    output["Word Frequencies"] = word_freq(INPUT_CSV)
-    make_verfied_charts(output)
-    make_wordcloud(output["Word Frequencies"])
-
-def sahil_main():
-    filename = INPUT_CSV
-    df = pd.read_csv(filename, encoding='utf-8')
-    df['Review Text'] = df['Review Text'].astype(str)
-    word = 'good'
-    visualize_top_words(df.copy())
-    visualize_word_usage_over_ratings(df, word)
-    word = 'comfortable'
-    visualize_word_usage_over_ratings(df, word)
+    results = cached_scan(filename, report_aggregators(), cache, jobs=jobs)
+
+    sns.set(style="whitegrid")
+    if not os.path.exists(plots_dir):
+        os.makedirs(plots_dir)
+    for function, args in report_figures(results, plots_dir):
+        function(*args)
 
 #connor_main()
 #zeyu_linxiao_main()
-#sahil_main()
\ No newline at end of file
+#sahil_main()
+#report_main()
\ No newline at end of file
@@ -0,0 +1,128 @@
+'''
+metadata_index.py - persistent asin -> price index for the metadata files
+
+Parsing a meta_*.json file just to pull out the prices is slow and the resulting dict
+grows with the size of the catalogue, so the prices are stored once in a SQLite file
+(meta_<category>.json.sqlite, in a folder of the caller's choosing so the metadata
+folder can stay read-only) and looked up in batches. The index
+remembers the size and modification time of the metadata file it was built from and
+is rebuilt automatically when those change.
+'''
+import os
+import sqlite3
+
+INDEX_SUFFIX = ".sqlite"
+
+# SQLite limits the number of ? parameters in a single statement
+LOOKUP_BATCH = 500
+
+def query_in_batches(conn, query, values):
+    '''
+    Runs a query with an "IN (%s)" clause for any number of values, LOOKUP_BATCH at a time
+    params:
+    conn - sqlite3 connection
+    query - the SELECT statement, with %s where the ? placeholders go
+    values - list of the values
+    yields - the result rows of all of the batches
+    '''
+    for i in range(0, len(values), LOOKUP_BATCH):
+        chunk = values[i:i + LOOKUP_BATCH]
+        yield from conn.execute(query % ",".join("?" * len(chunk)), chunk)
+
+def _source_stamp(meta_file):
+    stat = os.stat(meta_file)
+    return stat.st_size, stat.st_mtime_ns
+
+def build_price_index(index_file, items, stamp=(0, 0)):
+    '''
+    Builds the index from scratch
+    params:
+    index_file - path of the SQLite file to write
+    items - iterable of (asin, price) tuples, e.g. data_parser.iter_metadata(meta_file)
+    stamp - (size, mtime) of the metadata file the items came from
+    '''
+    assert(isinstance(index_file, str))
+    # build into a temporary file so a half built index is never picked up
+    tmp_file = index_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    conn = sqlite3.connect(tmp_file)
+    try:
+        conn.execute("CREATE TABLE prices (asin TEXT PRIMARY KEY, price TEXT) WITHOUT ROWID")
+        conn.execute("CREATE TABLE source (size INTEGER, mtime INTEGER)")
+        conn.execute("INSERT INTO source VALUES (?, ?)", stamp)
+        batch = []
+        for asin, price in items:
+            batch.append((str(asin), str(price)))
+            if len(batch) >= 10000:
+                # later duplicates replace earlier ones, same as load_metadata's dict
+                conn.executemany("INSERT OR REPLACE INTO prices VALUES (?, ?)", batch)
+                batch = []
+        conn.executemany("INSERT OR REPLACE INTO prices VALUES (?, ?)", batch)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_file, index_file)
+
+class PriceIndex:
+    '''
+    Read access to a built price index
+    params:
+    index_file - path to the SQLite index file
+    '''
+    def __init__(self, index_file):
+        assert(isinstance(index_file, str))
+        self.conn = sqlite3.connect(index_file)
+
+    def stamp(self):
+        '''
+        returns - (size, mtime) of the metadata file the index was built from
+        '''
+        try:
+            return tuple(self.conn.execute("SELECT size, mtime FROM source").fetchone())
+        except (sqlite3.DatabaseError, TypeError):
+            return None
+
+    def lookup(self, asins):
+        '''
+        Finds the prices for many product ids at once
+        params:
+        asins - iterable of product ids
+        returns - dict of asin -> price for the ids found in the index
+        '''
+        return dict(query_in_batches(self.conn, "SELECT asin, price FROM prices WHERE asin IN (%s)", list(set(asins))))
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def open_price_index(meta_file, read_metadata, index_dir=None):
+    '''
+    Opens the index for a metadata file, building it first if it is missing or out of date
+    params:
+    meta_file - path to the meta_*.json(.gz) file
+    read_metadata - function taking meta_file and returning an iterable of (asin, price)
+    index_dir - folder to keep the index in (created if needed), next to meta_file if not given
+    returns - PriceIndex
+    '''
+    assert(isinstance(meta_file, str))
+    assert(index_dir is None or isinstance(index_dir, str))
+    if index_dir is None:
+        index_file = meta_file + INDEX_SUFFIX
+    else:
+        os.makedirs(index_dir, exist_ok=True)
+        index_file = os.path.join(index_dir, os.path.basename(meta_file) + INDEX_SUFFIX)
+    stamp = _source_stamp(meta_file)
+    if os.path.exists(index_file):
+        index = PriceIndex(index_file)
+        if index.stamp() == stamp:
+            return index
+        index.close()
+    print(f"Building price index: {index_file}")
+    build_price_index(index_file, read_metadata(meta_file), stamp)
+    return PriceIndex(index_file)
@@ -0,0 +1,75 @@
+'''
+render.py - draws every chart of the report into the plots folder without a display
+
+The aggregates are computed once (one scan, see scan_engine.py and cache.py) in this
+process, then every chart of main.report_figures is drawn by a pool of worker processes
+with matplotlib's non-interactive Agg backend and saved as a png file instead of shown.
+'''
+import os
+# must be set before matplotlib is imported (by main)
+os.environ["MPLBACKEND"] = "Agg"
+import multiprocessing
+import time
+import matplotlib #3rd-party
+
+def _init_worker(plots_dir):
+    '''
+    Makes main.py save its charts into plots_dir
+    '''
+    import main
+    import seaborn as sns #3rd-party
+    main.SAVE_PLOTS = True
+    main.plots_directory = plots_dir
+    sns.set(style="whitegrid")
+
+def _draw(figure):
+    '''
+    Draws one chart of the report
+    params:
+    figure - (plot function, arguments) from main.report_figures
+    '''
+    function, args = figure
+    function(*args)
+
+def render_all(filename, plots_dir, jobs=1, charts="all", cache=None, scan_jobs=1):
+    '''
+    Saves the charts of the report as png files
+    params:
+    filename - the parsed csv or .parquet file
+    plots_dir - folder to save the charts to
+    jobs - number of processes drawing the charts
+    charts - "all", or only the charts of "connor", "zeyu" or "sahil"
+    cache - optional cache.AnalysisCache for the aggregates
+    scan_jobs - number of processes scanning the data
+    returns - number of charts drawn
+    '''
+    assert(isinstance(filename, str) and isinstance(plots_dir, str))
+    assert(isinstance(jobs, int) and jobs > 0)
+    import main
+    from cache import cached_scan
+    from tokenizer import get_stopwords
+    start = time.time()
+    os.makedirs(plots_dir, exist_ok=True)
+    # fetched here if needed, so the workers never download the stopwords at the same time
+    get_stopwords()
+    results = cached_scan(filename, main.report_aggregators(), cache, jobs=scan_jobs)
+    figures = main.report_figures(results, plots_dir, charts)
+    print(f"Aggregated {filename} in {time.time() - start:.1f}s, drawing {len(figures)} charts")
+
+    if jobs == 1:
+        # drawn in this process, so main's settings and the seaborn style are put back after
+        saved = (main.SAVE_PLOTS, main.plots_directory)
+        with matplotlib.rc_context():
+            try:
+                _init_worker(plots_dir)
+                for figure in figures:
+                    _draw(figure)
+            finally:
+                main.SAVE_PLOTS, main.plots_directory = saved
+    else:
+        with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(plots_dir,)) as pool:
+            # the charts take very different times, so hand them out one at a time
+            for _ in pool.imap_unordered(_draw, figures, chunksize=1):
+                pass
+    print(f"Saved {len(figures)} charts to {plots_dir} in {time.time() - start:.1f}s")
+    return len(figures)
@@ -0,0 +1,401 @@
+'''
+scan_engine.py - single pass scan over the parsed review data
+
+Each analysis is an aggregator that looks at one row at a time. scan() reads the
+parsed csv (or Parquet) file once and feeds every row to all of the registered
+aggregators, so the whole report costs one read of the data instead of one per
+analysis. Aggregators can also be merged, so partial results over different parts
+of the data can be combined.
+'''
+import csv
+import io
+import os
+import pickle
+import multiprocessing
+from array import array
+from collections import Counter
+from data_parser import price_to_float
+from tokenizer import tokenize, drop_stopwords, PhraseCounter
+from sketches import SpaceSaving, KLL
+
+RATINGS = ["1.0", "2.0", "3.0", "4.0", "5.0"]
+
+# Same bins and labels as zeyu_linxiao_main in main.py (left closed, like pd.cut(right=False))
+PRICE_BINS = [0, 10, 20, 30, 40, 50, 100, 200, 500]
+PRICE_LABELS = ['0-10', '10-20', '20-30', '30-40', '40-50', '50-100', '100-200', '200-500']
+
+def rating_key(value):
+    '''
+    Ratings are strings like "5.0" in the csv file and numbers in the Parquet file
+    '''
+    if isinstance(value, str):
+        return value
+    return "%.1f" % value
+
+def review_text(value):
+    '''
+    Missing review text is written as "N/A" by the parser
+    '''
+    if value is None or value == "N/A":
+        return ""
+    return str(value)
+
+def price_category(price):
+    '''
+    Finds the PRICE_LABELS label of a price, missing prices count as 0
+    returns - the label or None if the price is outside of the bins
+    '''
+    if price != price:
+        price = 0.0
+    for i in range(len(PRICE_LABELS)):
+        if PRICE_BINS[i] <= price < PRICE_BINS[i + 1]:
+            return PRICE_LABELS[i]
+    return None
+
+class Aggregator:
+    '''
+    Base class for the analyses run by scan()
+    start(header) is called once with the column names before any rows
+    update(row) is called with every row (a list in header order)
+    merge(other) adds the counts of another aggregator of the same kind
+    result() returns the finished analysis
+    params() returns the (json-able) settings that change the result, used by cache.py
+    '''
+    def start(self, header):
+        self.columns = {name: i for i, name in enumerate(header)}
+
+    def params(self):
+        return None
+
+    def update(self, row):
+        raise NotImplementedError
+
+    def merge(self, other):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+class VerifiedRatingAggregator(Aggregator):
+    '''
+    Counts the ratings of the verified and unverified reviews (verified_review_ratings)
+    '''
+    def __init__(self):
+        self.counts = {"verified-ratings": dict.fromkeys(RATINGS, 0),
+                       "unverified-ratings": dict.fromkeys(RATINGS, 0)}
+
+    def update(self, row):
+        if str(row[self.columns["Verified"]]).lower() == "true":
+            self.counts["verified-ratings"][rating_key(row[self.columns["Rating"]])] += 1
+        else:
+            self.counts["unverified-ratings"][rating_key(row[self.columns["Rating"]])] += 1
+
+    def merge(self, other):
+        for group in self.counts:
+            for rating, count in other.counts[group].items():
+                self.counts[group][rating] = self.counts[group].get(rating, 0) + count
+
+    def result(self):
+        return self.counts
+
+class WordFrequencyAggregator(Aggregator):
+    '''
+    Counts the words of all review texts without stopwords (word_freq)
+    params:
+    top - number of most common words to return
+    capacity - if given, the words are counted approximately with a sketches.SpaceSaving
+               summary of this many counters instead of an exact count of every distinct
+               word, so the memory stays fixed. The counts are then at most
+               (number of words) / capacity too high (see sketches.py)
+    '''
+    def __init__(self, top=100, capacity=None):
+        self.top = top
+        self.capacity = capacity
+        self.counts = Counter()
+        self.sketch = None if capacity is None else SpaceSaving(capacity)
+
+    def params(self):
+        if self.capacity is None:
+            return {"top": self.top}
+        return {"top": self.top, "capacity": self.capacity}
+
+    def update(self, row):
+        # stopwords are dropped once in result() (or when the batch goes into the sketch)
+        self.counts.update(tokenize(review_text(row[self.columns["Review Text"]]), remove_stopwords=False))
+        if self.sketch is not None and len(self.counts) >= self.capacity:
+            self._flush()
+
+    def _flush(self):
+        '''
+        Moves the exact counts of the current batch into the sketch
+        '''
+        self.sketch.update_counts(drop_stopwords(self.counts))
+        self.counts = Counter()
+
+    def merge(self, other):
+        if self.sketch is None:
+            self.counts.update(other.counts)
+            return
+        self._flush()
+        other._flush()
+        self.sketch.merge(other.sketch)
+
+    def result(self):
+        if self.sketch is None:
+            return dict(drop_stopwords(self.counts).most_common(self.top))
+        self._flush()
+        return dict(self.sketch.top(self.top))
+
+class CategoryWordAggregator(Aggregator):
+    '''
+    Counts the words (see tokenizer.py) of the reviews of every category and rating
+    result - dict of (category, rating) -> Counter
+    '''
+    def __init__(self):
+        self.counts = {}
+
+    def update(self, row):
+        key = (row[self.columns["Source Category"]], rating_key(row[self.columns["Rating"]]))
+        if key not in self.counts:
+            self.counts[key] = Counter()
+        # stopwords are dropped once in result()
+        self.counts[key].update(tokenize(review_text(row[self.columns["Review Text"]]), remove_stopwords=False))
+
+    def merge(self, other):
+        for key, counts in other.counts.items():
+            self.counts.setdefault(key, Counter()).update(counts)
+
+    def result(self):
+        for counts in self.counts.values():
+            drop_stopwords(counts)
+        return self.counts
+
+class WordUsageAggregator(Aggregator):
+    '''
+    Counts how often each word (or phrase) and its "not <word>" form are used in the
+    reviews of every category and rating, the same way as count_word_occurrences. All of
+    the words are counted in one pass over each review (see tokenizer.PhraseCounter)
+    params:
+    words - list of the words and phrases to count
+    result - dict of word -> {(category, rating): {"good": count, "not good": count}}
+    '''
+    def __init__(self, words):
+        self.words = list(words)
+        self.counter = PhraseCounter(self.words)
+        self.counts = {}
+
+    def params(self):
+        return {"words": self.words}
+
+    def update(self, row):
+        key = (row[self.columns["Source Category"]], rating_key(row[self.columns["Rating"]]))
+        cell = self.counts.get(key)
+        if cell is None:
+            cell = self.counts[key] = dict.fromkeys(self.counter.terms, 0)
+        self.counter.count(tokenize(review_text(row[self.columns["Review Text"]]), remove_stopwords=False), cell)
+
+    def merge(self, other):
+        for key, counts in other.counts.items():
+            cell = self.counts.setdefault(key, dict.fromkeys(self.counter.terms, 0))
+            for term, count in counts.items():
+                cell[term] += count
+
+    def result(self):
+        names = self.counter.names
+        return {word: {key: {"good": cell[names[word]], "not good": cell[names["not " + word]]}
+                       for key, cell in self.counts.items()}
+                for word in self.words}
+
+class PriceStatsAggregator(Aggregator):
+    '''
+    Price statistics used by zeyu_linxiao_main. Prices are parsed like handle_price and
+    missing prices count as 0 (the "Price Lower Bound" column)
+    result - dict with
+        "rating by price category": {(category, price category): [rating sum, count]}
+        "rating counts": {rating: count}
+        "prices by rating": {(category, rating): sketches.KLL of the prices}
+    The prices of every category and rating go into a fixed size quantile sketch (see
+    sketches.py) instead of being kept, so the medians work on any amount of data
+    params:
+    k - size of the sketches, the median's rank is off by about 1.7 / k
+    '''
+    # prices are buffered and added to their sketch this many at a time
+    BATCH = 10000
+
+    def __init__(self, k=200):
+        self.k = k
+        self.by_price_category = {}
+        self.rating_counts = Counter()
+        self.prices = {}
+        self.pending = {}
+
+    def params(self):
+        return {"k": self.k}
+
+    def _flush(self):
+        for key, prices in self.pending.items():
+            self.prices.setdefault(key, KLL(self.k)).update_many(prices)
+        self.pending = {}
+
+    def update(self, row):
+        category = row[self.columns["Source Category"]]
+        rating = rating_key(row[self.columns["Rating"]])
+        if "Price" in self.columns:
+            price = row[self.columns["Price"]]
+        else:
+            price = price_to_float(row[self.columns["Product Price"]])
+        if price != price:
+            price = 0.0
+        self.rating_counts[rating] += 1
+        pending = self.pending.get((category, rating))
+        if pending is None:
+            pending = self.pending[(category, rating)] = array('d')
+        pending.append(price)
+        if len(pending) >= self.BATCH:
+            self.prices.setdefault((category, rating), KLL(self.k)).update_many(pending)
+            del self.pending[(category, rating)]
+        label = price_category(price)
+        if label is not None:
+            cell = self.by_price_category.setdefault((category, label), [0.0, 0])
+            cell[0] += float(rating)
+            cell[1] += 1
+
+    def merge(self, other):
+        self.rating_counts.update(other.rating_counts)
+        self._flush()
+        other._flush()
+        for key, sketch in other.prices.items():
+            self.prices.setdefault(key, KLL(self.k)).merge(sketch)
+        for key, (total, count) in other.by_price_category.items():
+            cell = self.by_price_category.setdefault(key, [0.0, 0])
+            cell[0] += total
+            cell[1] += count
+
+    def result(self):
+        self._flush()
+        return {"rating by price category": self.by_price_category,
+                "rating counts": dict(self.rating_counts),
+                "prices by rating": self.prices}
+
+def iter_rows(filename):
+    '''
+    Reads the parsed review data one row at a time
+    params:
+    filename - the parsed csv file or the .parquet file from data_parser
+    yields - the header first, then every row as a list
+    '''
+    assert(isinstance(filename, str))
+    if filename.endswith(".parquet"):
+        import pyarrow.parquet as pq #3rd-party
+        parquet = pq.ParquetFile(filename)
+        yield parquet.schema_arrow.names
+        for batch in parquet.iter_batches():
+            yield from zip(*(column.to_pylist() for column in batch.columns))
+        return
+    with open(filename, 'r', encoding='UTF8', newline='') as f:
+        yield from csv.reader(f)
+
+def record_aligned_ranges(filename, chunk_bytes):
+    '''
+    Splits a parsed csv file into byte ranges of about chunk_bytes that start and end on
+    record boundaries. Review texts can contain quoted newlines, so a newline only ends a
+    record when an even number of quote characters come before it (escaped quotes are
+    doubled, so they do not change that)
+    params:
+    filename - the parsed csv file
+    chunk_bytes - the target size of a range
+    returns - (header line, list of (start, end) byte offsets of the rows after the header)
+    '''
+    assert(isinstance(filename, str) and isinstance(chunk_bytes, int) and chunk_bytes > 0)
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        header = f.readline()
+        start = f.tell()
+        boundaries = [start]
+        target = start + chunk_bytes
+        quotes = 0  # number of quote characters before the current block
+        block_start = start
+        while target < size:
+            block = f.read(1 << 20)
+            if not block:
+                break
+            i = max(target - block_start, 0)
+            while i < len(block):
+                i = block.find(b'\n', i)
+                if i < 0:
+                    break
+                if (quotes + block.count(b'"', 0, i)) % 2 == 0:
+                    boundaries.append(block_start + i + 1)
+                    target = block_start + i + 1 + chunk_bytes
+                    i = max(target - block_start, i + 1)
+                else:
+                    i += 1
+            quotes += block.count(b'"')
+            block_start += len(block)
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return header, list(zip(boundaries[:-1], boundaries[1:]))
+
+def _scan_range(task):
+    '''
+    Worker for the parallel mode of scan. Feeds the rows in one byte range to the aggregators
+    params:
+    task - tuple of (filename, header, start, end, pickled aggregators)
+    returns - the aggregators
+    '''
+    filename, header, start, end, aggregators = task
+    aggregators = pickle.loads(aggregators)
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('UTF8')
+    for aggregator in aggregators.values():
+        aggregator.start(header)
+    updates = [aggregator.update for aggregator in aggregators.values()]
+    for row in csv.reader(io.StringIO(text, newline='')):
+        for update in updates:
+            update(row)
+    return aggregators
+
+def scan(filename, aggregators, jobs=1, chunk_bytes=64 << 20):
+    '''
+    Feeds every row of the parsed review data to all of the aggregators in one pass
+    params:
+    filename - the parsed csv file or the .parquet file from data_parser
+    aggregators - dict of name -> Aggregator
+    jobs - number of worker processes. With more than one, the csv file is split into
+           record aligned byte ranges (see record_aligned_ranges) that are scanned by the
+           workers, and their aggregators are merged back in file order. Exact counts and
+           sums are the same as with one job, but the sketches (the price quantiles of
+           PriceStatsAggregator and WordFrequencyAggregator with a capacity, see
+           sketches.py) are approximate and their results depend on how the data is split,
+           so e.g. a median can differ a little from the one job result. Parquet files are
+           always scanned in this process
+    chunk_bytes - size of the byte ranges in the parallel mode
+    returns - dict of name -> the aggregator's result
+    '''
+    assert(isinstance(filename, str) and isinstance(aggregators, dict))
+    assert(isinstance(jobs, int) and jobs > 0)
+    if jobs > 1 and not filename.endswith(".parquet"):
+        header, ranges = record_aligned_ranges(filename, chunk_bytes)
+        header = next(csv.reader([header.decode('UTF8')]))
+        for aggregator in aggregators.values():
+            aggregator.start(header)
+        # every task gets a copy of the still empty aggregators. They are pickled here
+        # because the pool sends the tasks lazily, while the results are merged into them
+        empty = pickle.dumps(aggregators)
+        tasks = [(filename, header, start, end, empty) for start, end in ranges]
+        with multiprocessing.Pool(jobs) as pool:
+            for partial in pool.imap(_scan_range, tasks):
+                for name, aggregator in aggregators.items():
+                    aggregator.merge(partial[name])
+        return {name: aggregator.result() for name, aggregator in aggregators.items()}
+
+    rows = iter_rows(filename)
+    header = next(rows)
+    for aggregator in aggregators.values():
+        aggregator.start(header)
+    updates = [aggregator.update for aggregator in aggregators.values()]
+    for row in rows:
+        for update in updates:
+            update(row)
+    return {name: aggregator.result() for name, aggregator in aggregators.items()}
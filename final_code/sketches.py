@@ -0,0 +1,287 @@
+'''
+sketches.py - fixed size summaries of data that is too big to count exactly
+
+SpaceSaving finds the most common items of a stream while keeping at most `capacity`
+counters (Metwally, Agrawal and El Abbadi, "Efficient Computation of Frequent and
+Top-k Elements in Data Streams"). When a new item arrives and all counters are in use,
+the item with the smallest count is replaced and the new item inherits that count, so
+the counters always add up to the number of items seen (N). That gives the guarantees:
+    - a count is never below the item's true count
+    - a count is at most error_bound() = N / capacity above the true count (the stored
+      error of each item is a tighter bound for that item)
+    - every item whose true count is above N / capacity is in the summary
+so the top words of a Zipf-like vocabulary come out exactly or very close to it with a
+few thousand counters, no matter how many distinct words there are. Summaries of
+different parts of the data can be merged (Agarwal et al., "Mergeable Summaries").
+
+KLL estimates quantiles (medians, percentiles) of a stream of numbers in a small,
+mergeable summary (Karnin, Lang and Liberty, "Optimal Quantile Approximation in
+Streams"). It keeps a stack of compactors: when a level is full its values are sorted
+and every other one moves up a level, where it stands for twice as many values. A
+quantile's rank is then off by about 1.7 / k of the count with high probability (under
+1% with the default k=200), while only about 3k values are kept however long the
+stream is. The count, sum, min and max are exact.
+'''
+import heapq
+import math
+import random
+from bisect import bisect_left
+from itertools import accumulate
+
+class SpaceSaving:
+    '''
+    Approximate counts of the most common items
+    params:
+    capacity - the most counters to keep, memory is proportional to it
+    '''
+    def __init__(self, capacity=10000):
+        assert(isinstance(capacity, int) and capacity > 0)
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+        # (count, item) with one entry per item, an entry can be older (smaller) than the
+        # item's count, those are fixed when they reach the top
+        self._heap = []
+
+    def _pop_min(self):
+        heap = self._heap
+        while True:
+            count, item = heap[0]
+            current = self.counts[item]
+            if current == count:
+                heapq.heappop(heap)
+                return count, item
+            heapq.heapreplace(heap, (current, item))
+
+    def update(self, item, weight=1):
+        '''
+        Counts an item weight times
+        '''
+        self.total += weight
+        counts = self.counts
+        if item in counts:
+            counts[item] += weight
+            return
+        if len(counts) < self.capacity:
+            counts[item] = weight
+            self.errors[item] = 0
+            heapq.heappush(self._heap, (weight, item))
+            return
+        floor, victim = self._pop_min()
+        del counts[victim]
+        del self.errors[victim]
+        counts[item] = floor + weight
+        self.errors[item] = floor
+        heapq.heappush(self._heap, (floor + weight, item))
+
+    def update_counts(self, counts):
+        '''
+        Adds exact counts, e.g. a Counter of a batch of the stream
+        params:
+        counts - dict of item -> count
+        '''
+        for item, weight in counts.items():
+            self.update(item, weight)
+
+    def min_count(self):
+        '''
+        returns - the count an item that is not in the summary can at most have
+        '''
+        if len(self.counts) < self.capacity:
+            return 0
+        count, item = self._pop_min()
+        heapq.heappush(self._heap, (count, item))
+        return count
+
+    def error_bound(self):
+        '''
+        returns - the most any count can be above the true count, N / capacity
+        '''
+        return self.total / self.capacity
+
+    def merge(self, other):
+        '''
+        Adds another summary (of a different part of the data) to this one. An item missing
+        from one of the summaries gets that summary's min_count, the highest count it could
+        have had there, and then the capacity largest counts are kept.
+        '''
+        assert(isinstance(other, SpaceSaving))
+        own_min = self.min_count()
+        other_min = other.min_count()
+        merged = []
+        for item in self.counts.keys() | other.counts.keys():
+            count = self.counts.get(item, own_min) + other.counts.get(item, other_min)
+            error = self.errors.get(item, own_min) + other.errors.get(item, other_min)
+            merged.append((count, error, item))
+        if len(merged) > self.capacity:
+            merged = heapq.nlargest(self.capacity, merged, key=lambda entry: entry[0])
+        self.counts = {item: count for count, error, item in merged}
+        self.errors = {item: error for count, error, item in merged}
+        self.total += other.total
+        self._heap = [(count, item) for count, error, item in merged]
+        heapq.heapify(self._heap)
+
+    def top(self, n):
+        '''
+        params:
+        n - number of items
+        returns - list of the n (item, count) with the largest counts, largest first
+        '''
+        return heapq.nlargest(n, self.counts.items(), key=lambda entry: entry[1])
+
+    def __contains__(self, item):
+        return item in self.counts
+
+    def __len__(self):
+        return len(self.counts)
+
+class KLL:
+    '''
+    Approximate quantiles of a stream of numbers
+    params:
+    k - size of the top compactor, the rank error is about 1.7 / k
+    seed - seed of the random choices made when compacting, so results can be repeated
+    '''
+    def __init__(self, k=200, seed=0):
+        assert(isinstance(k, int) and k >= 8)
+        self.k = k
+        self.rng = random.Random(seed)
+        self.compactors = []
+        self.max_size = 0
+        self.size = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._grow()
+
+    def _capacity(self, level):
+        # the top level holds k values and every level below it 2/3 as many
+        depth = len(self.compactors) - level - 1
+        return int(math.ceil((2 / 3) ** depth * self.k)) + 1
+
+    def _grow(self):
+        self.compactors.append([])
+        self.max_size = sum(self._capacity(level) for level in range(len(self.compactors)))
+
+    def _compress(self):
+        '''
+        Compacts the lowest full level: sorts it and moves every other value (starting at a
+        random one of the first two) up a level. An odd value out stays where it is
+        '''
+        for level, values in enumerate(self.compactors):
+            if len(values) >= self._capacity(level):
+                if level + 1 == len(self.compactors):
+                    self._grow()
+                values.sort()
+                keep = len(values) % 2
+                self.compactors[level + 1].extend(values[keep + self.rng.randrange(2)::2])
+                self.compactors[level] = values[:keep]
+                break
+        self.size = sum(len(values) for values in self.compactors)
+
+    def update(self, value):
+        '''
+        Adds one number
+        '''
+        value = float(value)
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.compactors[0].append(value)
+        self.size += 1
+        if self.size >= self.max_size:
+            self._compress()
+
+    def update_many(self, values):
+        '''
+        Adds an iterable (or numpy array) of numbers at once
+        '''
+        values = [float(value) for value in values]
+        if not values:
+            return
+        self.count += len(values)
+        self.sum += math.fsum(values)
+        self.min = min(self.min, min(values))
+        self.max = max(self.max, max(values))
+        # like merging a sketch that holds the block uncompacted
+        self.compactors[0].extend(values)
+        self.size += len(values)
+        while self.size >= self.max_size:
+            self._compress()
+
+    def merge(self, other):
+        '''
+        Adds another sketch (of a different part of the data) to this one
+        '''
+        assert(isinstance(other, KLL))
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for level, values in enumerate(other.compactors):
+            self.compactors[level].extend(values)
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.size = sum(len(values) for values in self.compactors)
+        while self.size >= self.max_size:
+            self._compress()
+
+    def is_exact(self):
+        '''
+        returns - True while nothing was compacted yet, i.e. every value is still kept
+        '''
+        return len(self.compactors[0]) == self.count
+
+    def _weighted(self):
+        '''
+        returns - (sorted values, cumulative weights), a value on level h stands for 2**h values
+        '''
+        pairs = sorted((value, 1 << level) for level, values in enumerate(self.compactors) for value in values)
+        return [value for value, _ in pairs], list(accumulate(weight for _, weight in pairs))
+
+    def quantile(self, q):
+        '''
+        params:
+        q - between 0 and 1, e.g. 0.5 for the median
+        returns - the value with about q * count values below it, NaN if there are no values
+        '''
+        assert(0 <= q <= 1)
+        if self.count == 0:
+            return math.nan
+        if q == 0:
+            return self.min
+        if q == 1:
+            return self.max
+        values, cumulative = self._weighted()
+        i = bisect_left(cumulative, q * cumulative[-1])
+        return values[min(i, len(values) - 1)]
+
+    def quantiles(self, qs):
+        '''
+        returns - list of quantile(q) for every q in qs
+        '''
+        return [self.quantile(q) for q in qs]
+
+    def median(self):
+        '''
+        The median, exactly like np.median (the mean of the two middle values of an even
+        number of values) as long as nothing was compacted, quantile(0.5) after that
+        '''
+        if self.count and self.is_exact():
+            values = sorted(self.compactors[0])
+            middle = len(values) // 2
+            if len(values) % 2:
+                return values[middle]
+            return (values[middle - 1] + values[middle]) / 2
+        return self.quantile(0.5)
+
+    def mean(self):
+        return self.sum / self.count if self.count else math.nan
+
+    def __len__(self):
+        return self.count
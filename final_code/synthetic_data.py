@@ -0,0 +1,209 @@
+'''
+synthetic_data.py - writes made up review and metadata files shaped like the Amazon data
+
+The real review files are too large to keep in the repository, so this writes files of
+any size that data_parser.process_reviews_folder reads exactly like the real ones:
+    <output>/reviews/<Category>_5.json      - one review per line with the same keys as
+                                              the 5-core review files
+    <output>/metadata/meta_<Category>.json  - one product per line, with its price
+The data is random but has the properties the pipeline depends on:
+    - words are drawn from a Zipfian vocabulary (the r-th most common word is used about
+      1 / r**ZIPF_EXPONENT as often as the most common one), with common English words
+      first and "good", "comfortable", "not", ... in it, and reviews of high ratings use
+      more positive words
+    - most ratings are 5, then 4, with few 2s and 3s, like the real data
+    - a few products get most of the reviews
+    - prices are single prices, ranges ("$5.49 - $12.99"), "N/A", empty or missing,
+      and some products have no metadata at all
+    - some reviews are verified, have images or are exact repeats of an earlier review
+The same seed always writes the same files.
+'''
+import os
+import gzip
+import json
+import math
+import random
+from bisect import bisect
+from itertools import accumulate
+
+DEFAULT_CATEGORIES = ["AMAZON_FASHION", "Appliances", "Office_Products", "Toys_and_Games"]
+
+# share of the ratings 1 to 5
+RATING_WEIGHTS = [0.07, 0.05, 0.08, 0.18, 0.62]
+ZIPF_EXPONENT = 1.1
+VOCABULARY_SIZE = 20000
+# the most common words, in order, the rest of the vocabulary is made up
+COMMON_WORDS = ["the", "i", "and", "it", "a", "to", "is", "this", "for", "of", "my", "in", "not", "but",
+                "with", "very", "great", "good", "they", "on", "size", "that", "so", "was", "love", "are",
+                "fit", "just", "well", "quality", "have", "be", "one", "nice", "comfortable", "as", "like",
+                "these", "product", "price", "would", "small", "little", "will", "work", "color", "wear",
+                "use", "all", "really", "more", "too", "perfect", "recommend", "can", "bought", "them",
+                "works", "time", "up", "look", "pretty", "cute", "do", "than", "only", "were", "had"]
+POSITIVE_WORDS = ["great", "good", "love", "perfect", "comfortable", "excellent", "happy", "recommend"]
+NEGATIVE_WORDS = ["return", "returned", "broke", "cheap", "disappointed", "waste", "poor", "bad"]
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "shi", "po", "ve", "da", "zu", "re", "an", "el", "or"]
+SUMMARIES = ["Five Stars", "Four Stars", "Three Stars", "Two Stars", "One Star", "Great product",
+             "Love it", "Not what I expected", "Works well", "Good value", "Disappointed"]
+STYLES = [{"Size:": " Large", "Color:": " Black"}, {"Size:": " Medium"}, {"Color:": " Blue"},
+          {"Format:": " Paperback"}]
+
+def make_vocabulary(size=VOCABULARY_SIZE, seed=0):
+    '''
+    params:
+    size - number of words
+    returns - list of distinct words, most common first
+    '''
+    rng = random.Random(seed)
+    words = list(dict.fromkeys(COMMON_WORDS + POSITIVE_WORDS + NEGATIVE_WORDS))
+    known = set(words)
+    while len(words) < size:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in known:
+            known.add(word)
+            words.append(word)
+    return words[:size]
+
+def zipf_weights(n, exponent=ZIPF_EXPONENT):
+    '''
+    returns - cumulative weights of n ranks, for random.choices(cum_weights=...)
+    '''
+    return list(accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+def make_price(rng):
+    '''
+    returns - a price string like the metadata files have, or None for no price key
+    '''
+    kind = rng.random()
+    if kind < 0.65:
+        return "$%.2f" % math.exp(rng.gauss(3, 1))
+    if kind < 0.77:
+        low = math.exp(rng.gauss(2.5, 0.8))
+        return "$%.2f - $%.2f" % (low, low * rng.uniform(1.2, 4))
+    if kind < 0.85:
+        return "N/A"
+    if kind < 0.93:
+        return ""
+    return None
+
+class ReviewWriter:
+    '''
+    Makes the reviews of one category
+    params:
+    rng - random.Random
+    vocabulary - words, most common first
+    products - number of products of the category
+    prefix - start of the product ids, keeps the ids of different categories apart
+    '''
+    def __init__(self, rng, vocabulary, products, prefix):
+        self.rng = rng
+        self.vocabulary = vocabulary
+        self.word_weights = zipf_weights(len(vocabulary))
+        self.products = ["B%s%07d" % (prefix, i) for i in range(products)]
+        self.product_weights = zipf_weights(products, 1.0)
+        self.reviewers = max(products * 3, 10)
+
+    def text(self, rating):
+        rng = self.rng
+        length = max(1, min(int(rng.lognormvariate(3.2, 0.9)), 1000))
+        words = rng.choices(self.vocabulary, cum_weights=self.word_weights, k=length)
+        # 1 star reviews are mostly negative, 5 star reviews mostly positive
+        for _ in range(rng.randint(0, 3)):
+            position = rng.randrange(len(words) + 1)
+            if rng.random() < (rating - 1) / 4:
+                words.insert(position, rng.choice(POSITIVE_WORDS))
+            elif rng.random() < 0.3:
+                words[position:position] = ["not", rng.choice(POSITIVE_WORDS)]
+            else:
+                words.insert(position, rng.choice(NEGATIVE_WORDS))
+        words[0] = words[0].capitalize()
+        return " ".join(words) + rng.choice([".", "!", "", "..."])
+
+    def review(self, number):
+        rng = self.rng
+        rating = rng.choices(range(1, 6), weights=RATING_WEIGHTS)[0]
+        time = 1262304000 + rng.randrange(9 * 365 * 86400)
+        review = {"overall": float(rating),
+                  "verified": rng.random() < 0.85,
+                  "reviewTime": "%02d %d, %d" % (rng.randint(1, 12), rng.randint(1, 28), 2010 + (time - 1262304000) // (365 * 86400)),
+                  "reviewerID": "A%013X" % rng.randrange(self.reviewers),
+                  "asin": self.products[bisect(self.product_weights, rng.random() * self.product_weights[-1])],
+                  "style": rng.choice(STYLES),
+                  "reviewerName": "Reviewer %d" % number,
+                  "reviewText": self.text(rating),
+                  "summary": rng.choice(SUMMARIES),
+                  "unixReviewTime": time}
+        if rng.random() < 0.3:
+            review["vote"] = str(rng.randint(2, 200))
+        if rng.random() < 0.05:
+            review["image"] = ["https://images-na.ssl-images-amazon.com/images/I/%dL._SY88.jpg" % rng.randrange(10**8)]
+        # a few reviews have no text at all, which the parser turns into "N/A"
+        if rng.random() < 0.002:
+            del review["reviewText"]
+        return review
+
+def _open(path, compress):
+    if compress:
+        return gzip.open(path + ".gz", 'wt', encoding='UTF8')
+    return open(path, 'w', encoding='UTF8')
+
+def generate_dataset(output_dir, reviews, categories=None, seed=0, duplicate_rate=0.01, compress=False):
+    '''
+    Writes synthetic review and metadata files
+    params:
+    output_dir - folder to write the reviews and metadata folders into, created if needed
+    reviews - total number of reviews, split evenly over the categories
+    categories - category names, DEFAULT_CATEGORIES if not given
+    seed - seed of the random numbers
+    duplicate_rate - share of the reviews that repeat an earlier review of the category
+    compress - write .json.gz files like the dataset is distributed
+    returns - (review folder, metadata folder) to pass to process_reviews_folder
+    '''
+    assert(isinstance(output_dir, str))
+    assert(isinstance(reviews, int) and reviews >= 0)
+    assert(0 <= duplicate_rate < 1)
+    categories = DEFAULT_CATEGORIES if categories is None else list(categories)
+    review_dir = os.path.join(output_dir, "reviews")
+    meta_dir = os.path.join(output_dir, "metadata")
+    os.makedirs(review_dir, exist_ok=True)
+    os.makedirs(meta_dir, exist_ok=True)
+    vocabulary = make_vocabulary(seed=seed)
+
+    for index, category in enumerate(categories):
+        rng = random.Random(f"{seed}-{category}")
+        count = reviews // len(categories) + (index < reviews % len(categories))
+        writer = ReviewWriter(rng, vocabulary, max(count // 10, 1), "%02d" % index)
+        print(f"Writing {count} reviews: {category}_5.json")
+        # earlier reviews to repeat, a bounded sample so memory does not grow with count
+        recent = []
+        with _open(os.path.join(review_dir, f"{category}_5.json"), compress) as f:
+            for number in range(count):
+                if recent and rng.random() < duplicate_rate:
+                    line = rng.choice(recent)
+                else:
+                    line = json.dumps(writer.review(number))
+                    if len(recent) < 1000:
+                        recent.append(line)
+                    else:
+                        recent[rng.randrange(1000)] = line
+                f.write(line + "\n")
+
+        with _open(os.path.join(meta_dir, f"meta_{category}.json"), compress) as f:
+            for asin in writer.products:
+                # some products are missing from the metadata
+                if rng.random() < 0.02:
+                    continue
+                product = {"category": [category.replace("_", " ")],
+                           "description": [writer.text(5)],
+                           "title": " ".join(rng.choices(vocabulary[:500], k=8)),
+                           "brand": "Brand %d" % rng.randrange(1000),
+                           "rank": "%d in %s" % (rng.randrange(1, 10**6), category.replace("_", " ")),
+                           "main_cat": category.replace("_", " "),
+                           "asin": asin}
+                price = make_price(rng)
+                if price is not None:
+                    product["price"] = price
+                f.write(json.dumps(product) + "\n")
+    return review_dir, meta_dir
+
+if __name__ == "__main__":
+    generate_dataset("synthetic_data", 100000)
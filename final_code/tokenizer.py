@@ -0,0 +1,180 @@
+'''
+tokenizer.py - the one tokenizer used by all of the word analyses
+
+A review is lowercased, every string.punctuation character is removed with a single
+str.translate call and the result is split on whitespace. Stopwords (NLTK's english
+list) can be dropped afterwards. The stopword set is loaded once and cached.
+PhraseCounter counts many words and phrases in the tokenized reviews at once.
+'''
+import string
+from collections import Counter
+from functools import lru_cache
+
+_PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+@lru_cache(maxsize=None)
+def get_stopwords():
+    '''
+    returns - frozenset of NLTK's english stopwords, loaded on first use (and downloaded
+              first if this machine does not have them yet)
+    '''
+    import nltk #3rd-party
+    from nltk.corpus import stopwords #3rd-party
+    try:
+        return frozenset(stopwords.words('english'))
+    except LookupError:
+        nltk.download('stopwords', quiet=True)
+        return frozenset(stopwords.words('english'))
+
+def tokenize(text, remove_stopwords=True):
+    '''
+    Splits a review into lowercase words without punctuation
+    params:
+    text - the review text
+    remove_stopwords - drop the NLTK english stopwords
+    returns - list of words
+    '''
+    words = text.lower().translate(_PUNCTUATION_TABLE).split()
+    if remove_stopwords:
+        stop_words = get_stopwords()
+        return [word for word in words if word not in stop_words]
+    return words
+
+def tokenize_many(texts, remove_stopwords=True):
+    '''
+    Tokenizes an iterable of reviews
+    params:
+    texts - iterable of review texts
+    remove_stopwords - drop the NLTK english stopwords
+    yields - the list of words of each review
+    '''
+    table = _PUNCTUATION_TABLE
+    stop_words = get_stopwords() if remove_stopwords else frozenset()
+    for text in texts:
+        words = text.lower().translate(table).split()
+        if remove_stopwords:
+            words = [word for word in words if word not in stop_words]
+        yield words
+
+def drop_stopwords(counts):
+    '''
+    Removes the stopwords from a Counter. Counting every word and dropping the stopwords
+    once at the end is much cheaper than checking every word as it is counted
+    params:
+    counts - Counter of word -> count, changed in place
+    returns - counts
+    '''
+    for word in get_stopwords():
+        counts.pop(word, None)
+    return counts
+
+def count_words(texts, remove_stopwords=True, counts=None, batch_size=10000):
+    '''
+    Counts the words of an iterable of reviews. The reviews are tokenized in batches
+    (joined with spaces, which gives the same words) to keep the per review overhead low
+    params:
+    texts - iterable of review texts
+    remove_stopwords - drop the NLTK english stopwords
+    counts - optional Counter to add the counts to
+    batch_size - number of reviews tokenized at once
+    returns - Counter of word -> count
+    '''
+    new_counts = Counter()
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) >= batch_size:
+            new_counts.update(tokenize(" ".join(batch), remove_stopwords=False))
+            batch = []
+    new_counts.update(tokenize(" ".join(batch), remove_stopwords=False))
+    if remove_stopwords:
+        drop_stopwords(new_counts)
+    if counts is None:
+        return new_counts
+    counts.update(new_counts)
+    return counts
+
+class PhraseCounter:
+    '''
+    Counts any number of words and multi-word phrases in a single pass over the words of
+    a review. The phrases are kept in a trie (nested dicts keyed by word), so every word
+    of the review costs one dict lookup no matter how many phrases are tracked, and only
+    the words that start a phrase walk further down the trie. Occurrences may overlap,
+    e.g. "not good" also counts as a "good". Terms that tokenize the same way (like "Good"
+    and "good") are counted once, under the first of them, see by_term.
+    params:
+    terms - iterable of the words and phrases to count, tokenized like the reviews
+    negations - also count the "not <term>" form of every term
+    '''
+    def __init__(self, terms, negations=True):
+        self.terms = []
+        # every term added -> the term it is counted under
+        self.names = {}
+        self.trie = {}
+        for term in terms:
+            self.add(term)
+            if negations:
+                self.add("not " + term)
+        self.first_words = frozenset(self.trie)
+
+    def add(self, term):
+        '''
+        Adds a word or phrase to count
+        '''
+        words = tokenize(term, remove_stopwords=False)
+        assert(len(words) > 0), f"'{term}' has no words"
+        node = self.trie
+        for word in words:
+            node = node.setdefault(word, {})
+        # the None key marks the end of a phrase and holds its name
+        if None not in node:
+            node[None] = term
+            self.terms.append(term)
+        self.names[term] = node[None]
+
+    def by_term(self, counts):
+        '''
+        params:
+        counts - dict of term -> count from count or count_texts
+        returns - dict with the count of every term added, including the ones counted
+                  under an earlier term that tokenizes the same way
+        '''
+        return {term: counts[name] for term, name in self.names.items()}
+
+    def count(self, words, counts=None):
+        '''
+        Counts the terms in the words of one review
+        params:
+        words - list of words (see tokenize)
+        counts - optional dict of term -> count to add to
+        returns - dict of term -> count
+        '''
+        if counts is None:
+            counts = dict.fromkeys(self.terms, 0)
+        if self.first_words.isdisjoint(words):
+            return counts
+        trie = self.trie
+        n = len(words)
+        for i in range(n):
+            node = trie.get(words[i])
+            j = i + 1
+            while node is not None:
+                term = node.get(None)
+                if term is not None:
+                    counts[term] += 1
+                if j == n:
+                    break
+                node = node.get(words[j])
+                j += 1
+        return counts
+
+    def count_texts(self, texts, counts=None):
+        '''
+        Counts the terms in an iterable of review texts, one review at a time
+        returns - dict of term -> count
+        '''
+        if counts is None:
+            counts = dict.fromkeys(self.terms, 0)
+        for text in texts:
+            self.count(tokenize(text, remove_stopwords=False), counts)
+        return counts